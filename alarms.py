@@ -0,0 +1,129 @@
+import logging
+from time import monotonic
+from gi.repository import GLib
+from pages import DISPLAY_ROWS, DISPLAY_COLS
+
+class AlarmScheduler(object):
+	""" Shows alarm pages on top of whatever the user interface is showing.
+	    A newly raised alarm is shown as soon as its value changes, several
+	    active alarms are rotated, and once they are gone the lines that
+	    were on the display are put back. Pages are given highest priority
+	    first. After OVERLAY_TIMEOUT seconds the overlay hides itself, so
+	    that a display without keys does not stay on an alarm that does
+	    not clear; the alarm pages are then shown in the slideshow. """
+	ROTATE_INTERVAL = 3
+	OVERLAY_TIMEOUT = 30
+
+	def __init__(self, lcd, conn, pages):
+		self.lcd = lcd
+		self.conn = conn
+		self.active = []
+		self.dismissed = set()
+		self.current = None
+		self.saved = None
+		self.shown_at = 0
+		self.overlay_since = 0
+		self.pending = None
+		self.pages = []
+		self.set_pages(pages)
+
+	def set_pages(self, pages):
+		for page in self.pages:
+			if page not in pages:
+				page.listeners.remove(self.changed)
+		for page in pages:
+			if page not in self.pages:
+				page.listeners.append(self.changed)
+		self.pages = pages
+		self.changed()
+
+	@property
+	def showing(self):
+		return self.current is not None
+
+	def owns(self, page):
+		# True while the page is shown by the overlay rather than the slideshow
+		return page in self.active and page not in self.dismissed
+
+	def changed(self):
+		# Evaluate once per batch of changes
+		if self.pending is None:
+			self.pending = GLib.idle_add(self.update)
+
+	def update(self):
+		self.pending = None
+		active = []
+		for page in self.pages:
+			try:
+				lines = page.frame(self.conn)
+			except Exception:
+				logging.exception("Exception showing alarm")
+				lines = None
+			if lines is not None:
+				active.append((page, lines))
+
+		raised = [(p, lines) for p, lines in active if p not in self.active]
+		self.active = [p for p, _ in active]
+		# Alarms that cleared are shown again when they come back
+		self.dismissed.intersection_update(self.active)
+		visible = dict((p, lines) for p, lines in active if p not in self.dismissed)
+
+		if not visible:
+			self.restore()
+		elif raised:
+			self.show(*raised[0])
+		elif self.current in visible:
+			self.show(self.current, visible[self.current])
+		else:
+			page = next(p for p in self.active if p in visible)
+			self.show(page, visible[page])
+		return False
+
+	def tick(self):
+		# Rotate between active alarms. Pages may cycle through several
+		# alarms themselves, so the current one is refreshed as well; lines
+		# that did not change are not written again.
+		if not self.showing:
+			return
+		if monotonic() - self.overlay_since >= self.OVERLAY_TIMEOUT:
+			self.dismiss()
+			return
+		page = self.current
+		visible = [p for p in self.active if p not in self.dismissed]
+		if len(visible) > 1 and monotonic() - self.shown_at >= self.ROTATE_INTERVAL:
+			try:
+				page = visible[(visible.index(self.current) + 1) % len(visible)]
+			except ValueError:
+				page = visible[0]
+		lines = page.frame(self.conn)
+		if lines is not None:
+			self.show(page, lines)
+
+	def show(self, page, lines):
+		if self.saved is None:
+			self.saved = (dict(self.lcd.frames), self.lcd.page)
+			self.overlay_since = monotonic()
+		if page is not self.current:
+			self.shown_at = monotonic()
+		self.current = page
+		self.lcd.page = page.name
+		for row, line in enumerate(lines):
+			self.lcd.display_string(line, row + 1)
+
+	def restore(self):
+		if self.saved is not None:
+			frames, page = self.saved
+			for row in range(DISPLAY_ROWS):
+				self.lcd.display_string(frames.get(row + 1, " " * DISPLAY_COLS), row + 1)
+			self.lcd.page = page
+		self.saved = None
+		self.current = None
+
+	def dismiss(self):
+		""" Hides the alarms that are active now, until they are raised
+		    again. Returns True if there was something to hide. """
+		if not self.showing:
+			return False
+		self.dismissed.update(self.active)
+		self.restore()
+		return True
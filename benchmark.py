@@ -0,0 +1,183 @@
+#!/usr/bin/python3 -u
+
+# Microbenchmarks for the functions that run for every value change and
+# every render. Reports ns/op and the memory allocated per op, compares the
+# results with a baseline and exits with 1 if anything got slower than the
+# threshold allows. Baselines depend on the machine, so record them with
+# --save on the device the numbers are compared on.
+
+import sys
+import json
+import tracemalloc
+from time import perf_counter
+from argparse import ArgumentParser
+import dbus
+from evdev import ecodes
+
+import render
+render.install_language()
+
+from cache import smart_dict
+from track import Tracker
+from pages import format_line
+from lcddriver import VirtualLcd
+from four_button_pages import NumberEntryMenu
+from topology import PageManager, ScreenList
+from dbus_characterdisplay import _pages
+
+SERVICES = ("com.victronenergy.system", "com.victronenergy.settings",
+	"com.victronenergy.vebus.ttyO1", "com.victronenergy.solarcharger.ttyO2")
+
+class FakeBus(object):
+	""" Answers every GetValue with a value of the type the real services
+	    use, so the pages can be set up without a bus. """
+	def call_blocking(self, service, path, interface, method, signature, args, timeout=None):
+		if path == "/Ac/NumberOfPhases":
+			return dbus.Int32(3)
+		if path.endswith("Name"):
+			return dbus.String("Boat")
+		if path in ("/Connected", "/Ac/ActiveIn/Connected", "/Ac/ActiveIn/Source"):
+			# Connected, with AC in on grid, so that every page shows a frame
+			return dbus.Int32(1)
+		if path.endswith(("/State", "/ErrorCode", "/VebusError", "/Source")) or "/Alarms/" in path:
+			return dbus.Int32(2)
+		return dbus.Double(12.34)
+
+	def add_signal_receiver(self, handler, **kwargs):
+		return _Receiver()
+
+class _Receiver(object):
+	def remove(self):
+		pass
+
+def _unwrap():
+	tracker = Tracker()
+	values = [dbus.Double(12.5), dbus.Int32(3), dbus.String("Boat"), dbus.UInt64(7)]
+	return lambda: [tracker.unwrap_dbus_value(v) for v in values]
+
+def _update_cache():
+	tracker = Tracker()
+	value = dbus.Dictionary({"Value": dbus.Double(53.1), "Text": dbus.String("53.1V")},
+		signature="sv")
+	return lambda: tracker.update_cache(None, "battery_voltage", value)
+
+def _update_cache_invalid():
+	tracker = Tracker()
+	value = dbus.Dictionary({"Value": dbus.Array([], signature="i"), "Text": dbus.String("")},
+		signature="sv")
+	return lambda: tracker.update_cache(None, "battery_voltage", value)
+
+def _getattr():
+	d = smart_dict(battery_soc=55.0, battery_voltage=12.8, battery_power=-120.0)
+	return lambda: (d.battery_soc, d.battery_voltage, d.battery_power)
+
+def _format_line():
+	line = ["Battery", "12.84V"]
+	return lambda: format_line(line)
+
+def _number_entry():
+	lcd = VirtualLcd()
+	menu = NumberEntryMenu(None, 8, "Token", lambda conn, display, number: None)
+	menu.enter(None, lcd)
+	return lambda: menu.update(None, lcd, ecodes.KEY_UP)
+
+def _page_benchmarks():
+	# One benchmark per page, with every page set up against FakeBus
+	bus = FakeBus()
+	screens = ScreenList()
+	manager = PageManager(bus, _pages, screens)
+	for name in SERVICES:
+		manager.service_added(name)
+	for page in screens:
+		if page.name in ("LanPage", "WlanPage"):
+			continue # they ask connman, that is not what is measured here
+		page.activate()
+		yield page.name + ".get_text", (lambda page=page: lambda: page.get_text(None))
+
+BENCHMARKS = [
+	("Tracker.unwrap_dbus_value x4", _unwrap),
+	("Tracker.update_cache", _update_cache),
+	("Tracker.update_cache invalid", _update_cache_invalid),
+	("smart_dict.__getattr__ x3", _getattr),
+	("format_line", _format_line),
+	("NumberEntryMenu.update", _number_entry),
+]
+
+def measure(op, rounds, repeat=5):
+	""" Returns the best ns/op over `repeat` runs and the bytes allocated
+	    per op, which includes memory that is freed again. """
+	best = None
+	for _ in range(repeat):
+		start = perf_counter()
+		for _ in range(rounds):
+			op()
+		elapsed = perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+
+	samples = min(rounds, 1000)
+	allocated = 0
+	tracemalloc.start()
+	try:
+		for _ in range(samples):
+			before = tracemalloc.get_traced_memory()[0]
+			tracemalloc.reset_peak()
+			op()
+			allocated += tracemalloc.get_traced_memory()[1] - before
+	finally:
+		tracemalloc.stop()
+
+	return best / rounds * 1e9, allocated / samples
+
+def main():
+	parser = ArgumentParser(description=sys.argv[0])
+	parser.add_argument('--baseline',
+			help='Baseline file, default benchmark-baseline.json',
+			default='benchmark-baseline.json')
+	parser.add_argument('--save',
+			help='Store the results as the new baseline',
+			default=False, action="store_true")
+	parser.add_argument('--threshold',
+			help='Fail if ns/op exceeds the baseline by this factor, default 1.5',
+			type=float, default=1.5)
+	parser.add_argument('--rounds',
+			help='Operations per run, default 20000',
+			type=int, default=20000)
+	parser.add_argument('filter', nargs='?',
+			help='Only run benchmarks whose name contains this')
+	args = parser.parse_args()
+
+	try:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+	except (OSError, ValueError):
+		baseline = {}
+
+	results = {}
+	failed = []
+	print("{:<36} {:>10} {:>10} {:>10}".format("", "ns/op", "bytes/op", "baseline"))
+	for name, factory in BENCHMARKS + list(_page_benchmarks()):
+		if args.filter and args.filter not in name:
+			continue
+		ns, allocated = measure(factory(), args.rounds)
+		results[name] = {"ns": ns, "bytes": allocated}
+
+		reference = baseline.get(name, {}).get("ns")
+		status = ""
+		if reference is not None and ns > reference * args.threshold:
+			status = " REGRESSED"
+			failed.append(name)
+		print("{:<36} {:>10.0f} {:>10.0f} {:>10}{}".format(name, ns, allocated,
+			"-" if reference is None else "{:.0f}".format(reference), status))
+
+	if args.save:
+		baseline.update(results)
+		with open(args.baseline, "w") as f:
+			json.dump(baseline, f, indent=1, sort_keys=True)
+
+	if failed:
+		print("{} benchmark(s) slower than {}x the baseline".format(len(failed), args.threshold))
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -12,3 +12,16 @@ class smart_dict(dict):
 			raise AttributeError(k)
 	def __setattr__(self, k, v):
 		self[k] = v
+
+def plain_value(value):
+	# Returns value as an exact builtin type, which marshal can store
+	for t in (bool, int, float, str):
+		if isinstance(value, t):
+			return t(value)
+	return None
+
+def plain_key(key):
+	# Cache keys are strings or tuples of strings, like (service, path)
+	if isinstance(key, tuple):
+		return tuple(plain_key(k) for k in key)
+	return plain_value(key)
@@ -6,18 +6,33 @@ from os.path import basename, dirname, abspath
 from os.path import join as pathjoin
 from argparse import ArgumentParser
 import subprocess
+import signal
 import gettext
+from functools import partial
 import dbus
 from dbus.mainloop.glib import DBusGMainLoop
 from evdev import InputDevice, ecodes
 from gi.repository import GLib
 import lcddriver
+from framepub import FramePublisher
+from recorder import Recorder
+from track import Tracker
 from cache import smart_dict
 from pages import StatusPage, ReasonPage, BatteryPage, SolarPage, SolarHistoryPage, DetailedBatteryPage
 from pages import AcPage, AcPhasePage, AcOutPhasePage
+from pages import BatteryHistoryPage, SolarPeakPage, BatteryBarPage, SolarBarPage
 from pages import LanPage, WlanPage, VebusErrorPage, SolarErrorPage, VebusAlarmsPage
+from pages import EnergyPage, BatteryEnergyPage, Page
 from four_button_ui import FourButtonUserInterface
 from simple_ui import SimpleUserInterface
+from alarms import AlarmScheduler
+from topology import PageManager, ScreenList, ServiceEvents
+import snapshot
+from snapshot import SnapshotWriter
+from export import ValueExporter
+from energy import EnergyStore
+from eventlog import EventLog
+import tracering
 
 VERSION = 0.16
 FOUR_BUTTON_DEVICES = [b'victronenergy,paygo']
@@ -26,14 +41,54 @@ FOUR_BUTTON_DEVICES = [b'victronenergy,paygo']
 gettext.install("messages",
 	pathjoin(dirname(abspath(__file__)), "lang"))
 
-_screens = [StatusPage(), ReasonPage(), VebusErrorPage(),
-	VebusAlarmsPage(), AcPage(),
-	AcPhasePage(1), AcOutPhasePage(1),
-	AcPhasePage(2), AcOutPhasePage(2),
-	AcPhasePage(3), AcOutPhasePage(3),
-	BatteryPage(), SolarPage(), SolarErrorPage(),
-	SolarHistoryPage(0), SolarHistoryPage(1),
-	LanPage(), WlanPage()]
+# Pages in display order, as (factory, service type, phase). Pages are
+# created when a service of that type appears, see topology.PageManager.
+_pages = [
+	(StatusPage, None, 0),
+	(ReasonPage, "system", 0),
+	(VebusErrorPage, "vebus", 0),
+	(VebusAlarmsPage, "vebus", 0),
+	(AcPage, "vebus", 0),
+	(partial(AcPhasePage, 1), "vebus", 1),
+	(partial(AcOutPhasePage, 1), "vebus", 1),
+	(partial(AcPhasePage, 2), "vebus", 2),
+	(partial(AcOutPhasePage, 2), "vebus", 2),
+	(partial(AcPhasePage, 3), "vebus", 3),
+	(partial(AcOutPhasePage, 3), "vebus", 3),
+	(BatteryPage, "system", 0),
+	(SolarPage, "solarcharger", 0),
+	(SolarErrorPage, "solarcharger", 0),
+	(partial(SolarHistoryPage, 0), "solarcharger", 0),
+	(partial(SolarHistoryPage, 1), "solarcharger", 0),
+	(LanPage, None, 0),
+	(WlanPage, None, 0)]
+
+# Alarm pages in order of priority
+ALARM_PAGES = ("VebusErrorPage", "VebusAlarmsPage", "SolarErrorPage")
+
+
+def extra_display(spec, conn, manager, screens, scroll_interval, debug=False):
+	""" Sets up another display from DEVICE[:simple[:PAGE,...]]. It shares
+	    the pages with the main display and rolls through them, it has no
+	    keys of its own. Returns its user interface. """
+	parts = spec.split(":")
+	lcd = lcddriver.DebugLcd() if debug else lcddriver.Lcd(parts[0])
+	if not debug:
+		lcd.marquee.interval = scroll_interval
+	lcd.splash()
+	names = set(parts[2].split(",")) if len(parts) > 2 and parts[2] else None
+
+	view = ScreenList()
+	alarms = AlarmScheduler(lcd, conn, [])
+
+	def update():
+		view[:] = [p for p in screens if names is None or p.name in names]
+		alarms.set_pages([p for p in (view.find(name) for name in ALARM_PAGES) if p is not None])
+
+	manager.on_change.append(update)
+	update()
+
+	return SimpleUserInterface(lcd, conn, None, view, alarms)
 
 
 def main():
@@ -44,11 +99,49 @@ def main():
 	parser.add_argument('--lcd',
 			help='Path to lcd device, default /dev/lcd',
 			default='/dev/lcd')
+	parser.add_argument('--history',
+			help='Keep a history of battery voltage and PV power and add pages showing it',
+			default=False, action="store_true")
+	parser.add_argument('--bar-graphs',
+			help='Show battery and solar values as bar graphs',
+			default=False, action="store_true")
+	parser.add_argument('--scroll-interval',
+			help='Time between steps when scrolling text that does not fit, in ms',
+			default=400, type=int)
+	parser.add_argument('--publish',
+			help='Stream display contents to subscribers on this unix socket',
+			default=None)
+	parser.add_argument('--record',
+			help='Record all values and service changes to this file, for replay.py',
+			default=None)
+	parser.add_argument('--snapshot',
+			help='Keep a snapshot of the last known values in this file, to show them right away after a restart',
+			default='/run/dbus-characterdisplay.snapshot')
+	parser.add_argument('--export',
+			help='Export the system values to this memory mapped file for other local readers',
+			default=None)
+	parser.add_argument('--energy',
+			help='Integrate energy from the power values, keeping the counters in this file, and show energy pages',
+			default=None)
+	parser.add_argument('--events',
+			help='Log error and alarm transitions to this file and show them in the menu',
+			default=None)
+	parser.add_argument('--extra-lcd',
+			help='Also drive this display, as DEVICE[:simple[:PAGE,...]], can be repeated',
+			action='append', default=[])
+	parser.add_argument('--trace',
+			help='File the event trace is written to on SIGUSR1, in Chrome trace format if it ends in .json, default /tmp/dbus-characterdisplay.trace.json',
+			default='/tmp/dbus-characterdisplay.trace.json')
 	parser.add_argument('--version',
 			help='Print the version to stdout',
 			default=False, action="store_true")
 	args = parser.parse_args()
 
+	# The menus need keys, which only the main display has
+	for spec in args.extra_lcd:
+		if spec.split(":")[1:2] not in ([], [""], ["simple"]):
+			parser.error("--extra-lcd {}: extra displays can only roll through pages".format(spec))
+
 	if args.version:
 		print("{} v{}".format(basename(sys.argv[0]), VERSION))
 		return
@@ -63,6 +156,10 @@ def main():
 
 	# Get LCD display handler
 	lcd = lcddriver.DebugLcd() if args.debug else lcddriver.Lcd(args.lcd)
+	if not args.debug:
+		lcd.marquee.interval = args.scroll_interval
+	if args.publish:
+		lcd.publisher = FramePublisher(lcd, args.publish)
 
 	# Show spash screen while initialization
 	lcd.splash()
@@ -70,25 +167,77 @@ def main():
 	# Check the type of device
 	has_four_buttons = subprocess.check_output(["/usr/bin/board-compat"]).strip() in FOUR_BUTTON_DEVICES
 
+	pages = list(_pages)
+
 	# Add the screens only needed on the four button version
 	if has_four_buttons:
-		_screens.append(DetailedBatteryPage())
+		pages.append((DetailedBatteryPage, "solarcharger", 0))
+
+	if args.bar_graphs:
+		variants = {BatteryPage: BatteryBarPage, SolarPage: SolarBarPage}
+		pages = [(variants.get(factory, factory), requires, phase)
+			for factory, requires, phase in pages]
+
+	# History is opt-in, each series uses a fixed 26 kB
+	if args.history:
+		pages.extend([(BatteryHistoryPage, "system", 0), (SolarPeakPage, "solarcharger", 0)])
 
-	# Handle services that are already up
-	for name in conn.list_names():
-		if name.startswith("com.victronenergy."):
-			for screen in _screens:
-				screen.setup(conn, name)
+	store = None
+	if args.energy:
+		store = EnergyStore(args.energy)
+		pages.extend([(partial(EnergyPage, store), "vebus", 0),
+			(partial(BatteryEnergyPage, store), "system", 0)])
+
+	if args.events:
+		Page.events = EventLog(args.events)
+
+	if args.record:
+		Tracker.recorder = Recorder(args.record)
+
+	screens = ScreenList()
+	alarms = AlarmScheduler(lcd, conn, [])
+	manager = PageManager(conn, pages, screens)
+	manager.on_change.append(lambda: alarms.set_pages(
+		[p for p in (screens.find(name) for name in ALARM_PAGES) if p is not None]))
+
+	# Further displays share the pages, so every value is subscribed to and
+	# every page rendered once
+	extra = [extra_display(spec, conn, manager, screens, args.scroll_interval, args.debug)
+		for spec in args.extra_lcd]
+
+	if args.export:
+		manager.trackers.append(ValueExporter(args.export))
+
+	# Start from the last known state, if there is one
+	if args.snapshot:
+		data = snapshot.load(args.snapshot)
+		if data is not None:
+			manager.restore(data)
+		SnapshotWriter(args.snapshot, manager)
+
+	# Services that are already up are set up one at a time from idle, so
+	# that the display is not held up by querying all of them
+	pending = [str(name) for name in conn.list_names() if name.startswith("com.victronenergy.")]
+
+	def setup_pending():
+		if not pending:
+			manager.restore_done()
+			return False
+		name = pending.pop(0)
+		if Tracker.recorder is not None:
+			Tracker.recorder.name_owner_changed(name, '', str(conn.get_name_owner(name)))
+		manager.service_added(name)
+		return True
 
 	# watch name changes
+	events = ServiceEvents(manager)
+
 	def name_owner_changed(name, old, new):
 		if name.startswith('com.victronenergy.'):
-			if old:
-				for screen in _screens:
-					screen.cleanup(name)
-			if new:
-				for screen in _screens:
-					screen.setup(conn, name)
+			if name in pending:
+				pending.remove(name)
+			tracering.ring.add(tracering.OWNER, str(name), 1 if new else 0)
+			events.name_owner_changed(str(name), str(old), str(new))
 
 	conn.add_signal_receiver(name_owner_changed, signal_name='NameOwnerChanged')
 
@@ -100,11 +249,14 @@ def main():
 		kbd = None
 
 	if has_four_buttons:
-		ui_handler = FourButtonUserInterface(lcd, conn, kbd, _screens)
+		ui_handler = FourButtonUserInterface(lcd, conn, kbd, screens, alarms)
 	else:
-		ui_handler = SimpleUserInterface(lcd, conn, kbd, _screens)
+		ui_handler = SimpleUserInterface(lcd, conn, kbd, screens, alarms)
 
 	ui_handler.start()
+	for handler in extra:
+		handler.start()
+	GLib.idle_add(setup_pending)
 
 	if kbd is not None:
 		def keypress(fd, condition):
@@ -115,11 +267,29 @@ def main():
 
 	def tick():
 		ui_handler.tick()
+		for handler in extra:
+			handler.tick()
 		return True
 
 	GLib.timeout_add(1000, tick)
 
-	GLib.MainLoop().run()
+	def dump_trace():
+		tracering.ring.dump(args.trace)
+		return True
+
+	GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, dump_trace)
+
+	# Events still waiting for a batch are written before exiting
+	mainloop = GLib.MainLoop()
+	for signum in (signal.SIGTERM, signal.SIGINT):
+		GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, mainloop.quit)
+	try:
+		mainloop.run()
+	finally:
+		if Page.events is not None:
+			Page.events.flush()
+		if store is not None:
+			store.save()
 
 
 if __name__ == "__main__":
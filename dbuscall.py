@@ -0,0 +1,111 @@
+import logging
+from time import monotonic
+import dbus
+from tracering import ring, CALL_BEGIN, CALL_END
+
+# Default deadline for a blocking call, in milliseconds. The dbus-python
+# default is about 25 seconds, which freezes the display if a service hangs.
+DEFAULT_TIMEOUT_MS = 1000
+
+TIMEOUT_ERRORS = ("org.freedesktop.DBus.Error.NoReply",
+	"org.freedesktop.DBus.Error.Timeout",
+	"org.freedesktop.DBus.Error.TimedOut")
+
+class CircuitOpenError(Exception):
+	pass
+
+class CircuitBreaker(object):
+	# Stops calling a service after it failed to answer in time a number of
+	# times in a row. Once RETRY_INTERVAL has passed, the next call is let
+	# through as a probe; if that times out too the circuit opens again.
+	FAILURE_THRESHOLD = 3
+	RETRY_INTERVAL = 30
+
+	def __init__(self, name):
+		self.name = name
+		self.failures = 0
+		self.opened_at = None
+
+	@property
+	def open(self):
+		return self.opened_at is not None and \
+			monotonic() - self.opened_at < self.RETRY_INTERVAL
+
+	def success(self):
+		if self.opened_at is not None:
+			logging.info("{} is responding again".format(self.name))
+		self.failures = 0
+		self.opened_at = None
+
+	def failure(self):
+		self.failures += 1
+		if self.failures >= self.FAILURE_THRESHOLD:
+			if self.opened_at is None:
+				logging.warning("{} is not responding, not calling it for {} s".format(
+					self.name, self.RETRY_INTERVAL))
+			self.opened_at = monotonic()
+
+_breakers = {}
+
+def breaker(service):
+	try:
+		return _breakers[service]
+	except KeyError:
+		b = _breakers[service] = CircuitBreaker(service)
+		return b
+
+def circuit_open(service):
+	b = _breakers.get(service)
+	return b is not None and b.open
+
+def forget(service):
+	# Called when a service disappears, a new owner gets a fresh breaker
+	_breakers.pop(service, None)
+
+def call_blocking(conn, service, path, interface, method, signature='', args=(),
+		timeout_ms=DEFAULT_TIMEOUT_MS):
+	""" Blocking D-Bus method call with a deadline. Raises CircuitOpenError
+	    without calling when the service has stopped responding. """
+	b = breaker(service)
+	if b.open:
+		raise CircuitOpenError(service)
+
+	ring.add(CALL_BEGIN, (service, method))
+	try:
+		result = conn.call_blocking(service, path, interface, method,
+			signature, args, timeout=timeout_ms / 1000.0)
+	except dbus.exceptions.DBusException as e:
+		if e.get_dbus_name() in TIMEOUT_ERRORS:
+			b.failure()
+		else:
+			# The service answered, even if it was with an error
+			b.success()
+		raise
+	finally:
+		ring.add(CALL_END, (service, method))
+
+	b.success()
+	return result
+
+def call_async(conn, service, path, interface, method, signature='', args=(),
+		reply_handler=None, error_handler=None, timeout_ms=DEFAULT_TIMEOUT_MS):
+	""" Like call_blocking, but returns right away. The result or the
+	    exception is passed to one of the handlers from the main loop. """
+	b = breaker(service)
+	if b.open:
+		error_handler(CircuitOpenError(service))
+		return
+
+	def reply(*result):
+		b.success()
+		reply_handler(*result)
+
+	def error(e):
+		if isinstance(e, dbus.exceptions.DBusException) and e.get_dbus_name() in TIMEOUT_ERRORS:
+			b.failure()
+		else:
+			b.success()
+		error_handler(e)
+
+	conn.call_async(service, path, interface, method, signature, args,
+		reply, error, timeout=timeout_ms / 1000.0)
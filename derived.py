@@ -0,0 +1,12 @@
+# Functions for Tracker.derive, shared by the pages. Inputs that are not
+# available are None.
+
+def product(a, b):
+	if a is None or b is None:
+		return None
+	return a * b
+
+def reason_codes(*flags):
+	# "#1,3" for the first and third flag set, "" if none is
+	reasons = ",".join("{:X}".format(i) for i, v in enumerate(flags, 1) if v)
+	return "#" + reasons if reasons else ""
@@ -0,0 +1,110 @@
+import os
+import marshal
+import logging
+from datetime import date
+from time import monotonic
+from gi.repository import GLib
+
+class Integrator(object):
+	""" Integrates power updates in W into energy in kWh for today and
+	    yesterday, split by direction. Services only send a value when it
+	    changes, so the power of an update holds until the next one: the
+	    energy since the previous update is added when a new one comes in,
+	    and by advance() for readers that want it up to now. An invalid
+	    value stops the integration until the next valid one. """
+
+	def __init__(self, state=None):
+		self.day, self.today_in, self.today_out, self.yesterday_in, \
+			self.yesterday_out = state or (date.today().toordinal(), 0.0, 0.0, 0.0, 0.0)
+		self.last = None # (monotonic time, power) of the previous update
+
+	@property
+	def state(self):
+		return (self.day, self.today_in, self.today_out, self.yesterday_in,
+			self.yesterday_out)
+
+	def rollover(self, day):
+		if day == self.day + 1:
+			self.yesterday_in, self.yesterday_out = self.today_in, self.today_out
+		else:
+			self.yesterday_in = self.yesterday_out = 0.0
+		self.today_in = self.today_out = 0.0
+		self.day = day
+
+	def advance(self, now=None, day=None):
+		# Energy since the previous update goes to the day it is added on
+		now = monotonic() if now is None else now
+		day = date.today().toordinal() if day is None else day
+		if day != self.day:
+			self.rollover(day)
+
+		if self.last is not None:
+			then, power = self.last
+			if now > then:
+				kwh = power * (now - then) / 3600000.0
+				if kwh > 0:
+					self.today_in += kwh
+				else:
+					self.today_out -= kwh
+				self.last = (now, power)
+
+	def add(self, power, now=None, day=None):
+		now = monotonic() if now is None else now
+		self.advance(now, day)
+		self.last = None if power is None else (now, power)
+
+class EnergyStore(object):
+	""" Keeps the integrators by name and saves their counters every
+	    INTERVAL seconds, so that a restart only loses the energy since the
+	    last save. The file is small and only rewritten when a counter
+	    changed, to spare the flash. """
+	INTERVAL = 600
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.integrators = {}
+		self.saved = {}
+		try:
+			with open(filename, "rb") as f:
+				saved = marshal.load(f)
+			if isinstance(saved, dict):
+				self.saved = saved
+		except (OSError, EOFError, ValueError, TypeError):
+			pass
+		GLib.timeout_add_seconds(self.INTERVAL, self.save)
+
+	def integrator(self, name):
+		# The same integrator for the same name, also after a page is recreated
+		try:
+			return self.integrators[name]
+		except KeyError:
+			state = self.saved.get(name)
+			self.integrators[name] = i = Integrator(tuple(state) if state else None)
+			return i
+
+	def total(self, prefix, attr):
+		total = 0.0
+		for name, i in self.integrators.items():
+			if name.startswith(prefix):
+				i.advance()
+				total += getattr(i, attr)
+		return total
+
+	def save(self):
+		# Also bounds how much held power can end up on the wrong day
+		for i in self.integrators.values():
+			i.advance()
+		states = dict(self.saved)
+		states.update((name, i.state) for name, i in self.integrators.items())
+		if states == self.saved:
+			return True
+		tmp = self.filename + ".tmp"
+		try:
+			with open(tmp, "wb") as f:
+				marshal.dump(states, f)
+			os.rename(tmp, self.filename)
+		except OSError:
+			logging.exception("Failed to save energy counters to {}".format(self.filename))
+			return True
+		self.saved = states
+		return True
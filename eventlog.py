@@ -0,0 +1,97 @@
+import os
+import struct
+import logging
+from time import time
+from gi.repository import GLib
+
+# Kinds of events
+VEBUS_ERROR = 0
+SOLAR_ERROR = 1
+VEBUS_ALARM = 2
+
+MAGIC = b"CDEL"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII") # magic, version, record size, capacity, records written
+RECORD = struct.Struct("<IBBxxi12s") # time, kind, active, code, source
+SOURCE_WIDTH = 10
+
+class EventLog(object):
+	""" Error and alarm transitions in a fixed-size ring file. The file is
+	    allocated in full when created and records are written in place,
+	    so it never grows or gets rewritten. New events are kept in memory
+	    and written BATCH at a time, or FLUSH_INTERVAL seconds after the
+	    first one, to limit the number of writes to flash. """
+	CAPACITY = 512
+	BATCH = 16
+	FLUSH_INTERVAL = 300
+
+	def __init__(self, filename, capacity=CAPACITY):
+		self.filename = filename
+		self.pending = []
+		self.timer = None
+		self.fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+		header = os.pread(self.fd, HEADER.size, 0)
+		try:
+			magic, version, size, self.capacity, self.written = HEADER.unpack(header)
+			valid = magic == MAGIC and version == VERSION and size == RECORD.size
+		except struct.error:
+			valid = False
+		if not valid:
+			self.capacity, self.written = capacity, 0
+			os.ftruncate(self.fd, 0)
+			os.ftruncate(self.fd, HEADER.size + RECORD.size * capacity)
+			self.write_header()
+
+	def write_header(self):
+		os.pwrite(self.fd, HEADER.pack(MAGIC, VERSION, RECORD.size, self.capacity,
+			self.written), 0)
+
+	def __len__(self):
+		return min(self.written + len(self.pending), self.capacity)
+
+	def log(self, kind, service, code, active, now=None):
+		# Service is the D-Bus name, only the part after the type is kept,
+		# short enough to fit the event log line next to the time
+		source = service.split(".", 3)[-1]
+		if source.startswith("socketcan_"):
+			source = "_".join(source.split("_")[1:3])
+		source = source.encode("utf-8")[:SOURCE_WIDTH]
+		self.pending.append(RECORD.pack(int(time() if now is None else now),
+			kind, bool(active), code, source))
+		if len(self.pending) >= self.BATCH:
+			self.flush()
+		elif self.timer is None:
+			self.timer = GLib.timeout_add_seconds(self.FLUSH_INTERVAL, self.timeout)
+
+	def timeout(self):
+		self.timer = None
+		self.flush()
+		return False
+
+	def flush(self):
+		if self.timer is not None:
+			GLib.source_remove(self.timer)
+			self.timer = None
+		try:
+			for record in self.pending:
+				os.pwrite(self.fd, record,
+					HEADER.size + (self.written % self.capacity) * RECORD.size)
+				self.written += 1
+			self.write_header()
+		except OSError:
+			logging.exception("Failed to write events to {}".format(self.filename))
+		self.pending = []
+
+	def entry(self, i):
+		""" Returns (time, kind, active, code, source) of the i-th most
+		    recent event. """
+		if not 0 <= i < len(self):
+			raise IndexError(i)
+		n = self.written + len(self.pending) - 1 - i
+		if n >= self.written:
+			record = self.pending[n - self.written]
+		else:
+			record = os.pread(self.fd, RECORD.size,
+				HEADER.size + (n % self.capacity) * RECORD.size)
+		when, kind, active, code, source = RECORD.unpack(record)
+		return when, kind, bool(active), code, source.rstrip(b"\0").decode("utf-8", "replace")
@@ -0,0 +1,73 @@
+#!/usr/bin/python3 -u
+
+# Exports the system overview values to a memory mapped file (see
+# shmvalues.py), so that other local tools do not have to poll D-Bus.
+
+import sys
+from time import perf_counter
+from track import Tracker
+import shmvalues
+
+# Key in the export, service and path. The system service already combines
+# the battery, solar and inverter values, so one service covers everything.
+EXPORTS = [
+	("system/state", "com.victronenergy.system", "/SystemState/State"),
+	("battery/soc", "com.victronenergy.system", "/Dc/Battery/Soc"),
+	("battery/voltage", "com.victronenergy.system", "/Dc/Battery/Voltage"),
+	("battery/current", "com.victronenergy.system", "/Dc/Battery/Current"),
+	("battery/power", "com.victronenergy.system", "/Dc/Battery/Power"),
+	("battery/state", "com.victronenergy.system", "/Dc/Battery/State"),
+	("battery/timetogo", "com.victronenergy.system", "/Dc/Battery/TimeToGo"),
+	("pv/power", "com.victronenergy.system", "/Dc/Pv/Power"),
+	("ac/pv/power", "com.victronenergy.system", "/Ac/PvOnOutput/L1/Power"),
+	("ac/consumption/power", "com.victronenergy.system", "/Ac/Consumption/L1/Power"),
+	("ac/grid/power", "com.victronenergy.system", "/Ac/Grid/L1/Power"),
+	("ac/genset/power", "com.victronenergy.system", "/Ac/Genset/L1/Power"),
+	("ac/activein/source", "com.victronenergy.system", "/Ac/ActiveIn/Source"),
+	("system/name", "com.victronenergy.settings", "/Settings/SystemSetup/SystemName"),
+]
+
+class ValueExporter(Tracker):
+	""" Keeps the export file up to date. Set up and cleaned up for each
+	    service like a page, but always subscribed. """
+	def __init__(self, filename):
+		super(ValueExporter, self).__init__()
+		self.writer = shmvalues.Writer(filename, [key for key, _, _ in EXPORTS])
+
+	def setup(self, conn, name):
+		for i, (key, service, path) in enumerate(EXPORTS):
+			if name == service:
+				self.track(conn, name, path, key,
+					lambda v, i=i: self.writer.set(i, v))
+
+	def cleanup(self, name):
+		super(ValueExporter, self).cleanup(name)
+		for i, (key, service, path) in enumerate(EXPORTS):
+			if name == service:
+				self.cache.pop(key, None)
+				self.writer.set(i, None)
+
+def main():
+	# Compares reading the export with polling the same values over D-Bus
+	if len(sys.argv) != 2:
+		print("Usage: {} <export file>".format(sys.argv[0]))
+		return 1
+
+	import dbus
+	conn = dbus.SystemBus()
+	tracker = Tracker()
+	rounds = 100
+	start = perf_counter()
+	for _ in range(rounds):
+		for key, service, path in EXPORTS:
+			tracker.query(conn, service, path)
+	dbus_us = (perf_counter() - start) / rounds * 1e6
+
+	single, snapshot = shmvalues.benchmark(sys.argv[1])
+	print("GetValue for all {} values: {:10.1f} us".format(len(EXPORTS), dbus_us))
+	print("export snapshot:            {:10.1f} us".format(snapshot))
+	print("export single value:        {:10.1f} us".format(single))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,31 +1,231 @@
+from collections import OrderedDict
+from datetime import date, datetime
+from time import monotonic
 from evdev import ecodes
-from payg_service import PAYGService
+from pages import Page, VEBUS_ALARM_BITS, vebus_alarm_names
+import dbuscall
+import eventlog
 
 
 class StaticMenu(object):
+    """ Shows a page by name. Pages come and go with the installed
+        hardware, so the page is looked up every time. """
 
-    def __init__(self, static_page):
-        self._static_page = static_page
+    def __init__(self, static_pages, page_name):
+        self._static_pages = static_pages
+        self._page_name = page_name
+
+    @property
+    def _static_page(self):
+        return self._static_pages.find(self._page_name)
 
     def is_available(self, conn):
-        if self._static_page.get_text(conn) is None:
+        page = self._static_page
+        if page is None or page.get_text(conn) is None:
             return False
         return True
 
     def enter(self, conn, display):
-        self._static_page.display(conn, display)
+        page = self._static_page
+        if page is not None:
+            page.activate(self)
+            page.display(conn, display)
 
-    def update(self, conn, display, key_pressed):
+    def update(self, conn, display, key_pressed, steps=1):
         if key_pressed:
+            self.leave()
+            return False
+        return True
+
+    def leave(self):
+        page = self._static_page
+        if page is not None:
+            page.deactivate(self)
+
+
+class SolarHistoryMenu(object):
+    """ Steps through the daily history of the solar chargers with up and
+        down. A day is fetched with async GetValue calls when it is shown
+        and kept in a small LRU cache keyed by date, so that nothing is
+        subscribed and the keys stay responsive while a charger answers.
+        With several chargers, yield and peak power are their sums. """
+
+    DAYS = 30
+    CACHE_SIZE = 8
+    TODAY_MAX_AGE = 60  # seconds before today's values are fetched again
+
+    def __init__(self, conn, static_pages, alarms):
+        self.conn = conn
+        self._static_pages = static_pages
+        self.alarms = alarms
+        self.redraw = False
+        self.cache = OrderedDict()  # date ordinal -> day values
+        self.today = date.today().toordinal()
+        self.display = None
+        self.day = 0
+
+    def is_available(self, conn):
+        return self._static_pages.find('SolarPage') is not None
+
+    def enter(self, conn, display):
+        self.display = display
+        self.day = 0
+        self.show()
+
+    def update(self, conn, display, key_pressed, steps=1):
+        if key_pressed == ecodes.KEY_UP:
+            self.day = max(0, self.day - steps)
+        elif key_pressed == ecodes.KEY_DOWN:
+            self.day = min(self.DAYS - 1, self.day + steps)
+        elif key_pressed:
+            self.display = None
+            return False
+        else:
+            if self.redraw and not self.alarms.showing:
+                # Values came in while an alarm was on the display
+                self.show()
+            return True
+        self.show()
+        return True
+
+    def show(self):
+        today = date.today().toordinal()
+        if today != self.today:
+            # Only the days that were still running when fetched change
+            self.cache.pop(self.today, None)
+            self.cache.pop(today, None)
+            self.today = today
+
+        ordinal = today - self.day
+        values = self.cache.get(ordinal)
+        if values is None or (ordinal == today and
+                monotonic() - values['fetched'] > self.TODAY_MAX_AGE):
+            values = self.fetch(ordinal)
+        else:
+            self.cache.move_to_end(ordinal)
+        self.draw(ordinal, values)
+
+    def fetch(self, ordinal):
+        # The chargers SolarPage is subscribed to, which are the ones up
+        page = self._static_pages.find('SolarPage')
+        chargers = [] if page is None else [name for name in page.watches
+            if name.startswith('com.victronenergy.solarcharger.')]
+        values = {'fetched': monotonic(), 'pending': 0, 'chargers': len(chargers),
+            'yield': None, 'max_power': None, 'max_voltage': None}
+        self.cache[ordinal] = values
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+        day = self.today - ordinal
+        for name in chargers:
+            for path, key in (('Yield', 'yield'), ('MaxPower', 'max_power'),
+                    ('MaxBatteryVoltage', 'max_voltage')):
+                values['pending'] += 1
+                dbuscall.call_async(self.conn, name,
+                    '/History/Daily/{}/{}'.format(day, path),
+                    'com.victronenergy.BusItem', 'GetValue',
+                    reply_handler=lambda v, key=key: self.received(ordinal, values, key, v),
+                    error_handler=lambda e: self.received(ordinal, values, None, None))
+        return values
+
+    def received(self, ordinal, values, key, v):
+        values['pending'] -= 1
+        if key is not None and isinstance(v, (int, float)):
+            v = float(v)
+            if values[key] is None:
+                values[key] = v
+            elif key == 'max_voltage':
+                values[key] = max(values[key], v)
+            else:
+                # Yield and power add up over the chargers
+                values[key] += v
+        if values['pending'] == 0 and self.display is not None and \
+                ordinal == self.today - self.day:
+            # Not on top of an alarm, it is drawn when that is gone
+            if self.alarms.showing:
+                self.redraw = True
+            else:
+                self.draw(ordinal, values)
+
+    def draw(self, ordinal, values):
+        if self.day == 0:
+            label = 'Today'
+        elif self.day == 1:
+            label = 'Yesterday'
+        else:
+            label = date.fromordinal(ordinal).strftime('%d %b')
+
+        if values['pending']:
+            top, bottom = label, 'Loading...'
+        elif values['yield'] is None:
+            top, bottom = label, 'No data'
+        else:
+            top = '{}{:>{}}'.format(label, '{:.1f}kWh'.format(values['yield']), 16 - len(label))
+            power = '' if values['max_power'] is None else '{:.0f}W'.format(values['max_power'])
+            if power and values['chargers'] > 1:
+                power += ' sum'
+            voltage = '' if values['max_voltage'] is None else '{:.2f}V'.format(values['max_voltage'])
+            bottom = power + voltage.rjust(16 - len(power))
+        self.redraw = False
+        self.display.display_string(top.ljust(16), 1)
+        self.display.display_string(bottom.ljust(16), 2)
+
+
+class EventLogMenu(object):
+    """ Browses the error and alarm log, newest first, with up and down. """
+
+    KINDS = {
+        eventlog.VEBUS_ERROR: 'VE.Bus #{}',
+        eventlog.SOLAR_ERROR: 'MPPT #{}',
+    }
+
+    def __init__(self):
+        self.index = 0
+        self.alarms = vebus_alarm_names()
+
+    def is_available(self, conn):
+        return Page.events is not None and len(Page.events) > 0
+
+    def enter(self, conn, display):
+        self.index = 0
+        self.show(display)
+
+    def update(self, conn, display, key_pressed, steps=1):
+        if key_pressed == ecodes.KEY_UP:
+            self.index = max(0, self.index - steps)
+        elif key_pressed == ecodes.KEY_DOWN:
+            self.index = min(len(Page.events) - 1, self.index + steps)
+        elif key_pressed:
             return False
+        else:
+            return True
+        self.show(display)
         return True
 
+    def describe(self, kind, code):
+        if kind == eventlog.VEBUS_ALARM:
+            try:
+                path, alarm, phase = VEBUS_ALARM_BITS[code]
+            except IndexError:
+                return 'Alarm #{}'.format(code)
+            return '{} L{}'.format(self.alarms[alarm], phase) if phase else self.alarms[alarm]
+        return self.KINDS.get(kind, '#{}').format(code)
+
+    def show(self, display):
+        when, kind, active, code, source = Page.events.entry(self.index)
+        top = datetime.fromtimestamp(when).strftime('%H:%M')
+        top += source[:16 - len(top) - 1].rjust(16 - len(top))
+        bottom = self.describe(kind, code)[:12]
+        bottom += ('on' if active else 'off').rjust(16 - len(bottom))
+        display.display_string(top, 1)
+        display.display_string(bottom, 2)
+
 
 class TokenEntryMenu(object):
 
-    def __init__(self, conn):
+    def __init__(self, conn, payg_service):
         self.conn = conn
-        self.payg_service = PAYGService(self.conn)
+        self.payg_service = payg_service
         self.number_entry_menu = NumberEntryMenu(conn, 9, 'Enter Token', self.complete_token_entry)
 
     def is_available(self, conn):
@@ -45,7 +245,7 @@ class TokenEntryMenu(object):
             self.number_entry_menu.enter(conn, display)
 
 
-    def update(self, conn, display, key_pressed):
+    def update(self, conn, display, key_pressed, steps=1):
         if not self.payg_service.token_entry_allowed():
             display.display_string('Token entry lock'.center(16), 1)
             minutes = self.payg_service.get_minutes_of_token_block()
@@ -59,13 +259,16 @@ class TokenEntryMenu(object):
                 display.clear()
                 self.was_locked = False
                 self.number_entry_menu.enter(conn, display)
-            return self.number_entry_menu.update(conn, display, key_pressed)
+            return self.number_entry_menu.update(conn, display, key_pressed, steps)
         return True
 
     def complete_token_entry(self, conn, display, token_typed):
         token_status = self.payg_service.update_device_status_if_code_valid(int(token_typed))
         display.clear()
-        if token_status == 1:
+        if token_status is None:
+            display.display_string('No response'.center(16), 1)
+            display.display_string('Try again'.center(16), 2)
+        elif token_status == 1:
             display.display_string('Token Valid'.center(16), 1)
             if not self.payg_service.is_payg_enabled():
                 display.display_string('Active Forever'.center(16), 2)
@@ -83,9 +286,9 @@ class TokenEntryMenu(object):
 
 class PAYGStatusMenu(object):
 
-    def __init__(self, conn):
+    def __init__(self, conn, payg_service):
         self.conn = conn
-        self.payg_service = PAYGService(self.conn)
+        self.payg_service = payg_service
 
     def is_available(self, conn):
         return self.payg_service.service_available()
@@ -93,7 +296,7 @@ class PAYGStatusMenu(object):
     def enter(self, conn, display):
         self.update(conn, display, None)
 
-    def update(self, conn, display, key_pressed):
+    def update(self, conn, display, key_pressed, steps=1):
         if key_pressed:
             return False
         if not self.payg_service.is_payg_enabled():
@@ -139,7 +342,7 @@ class NumberEntryMenu(object):
         display.display_string(self.to_display.ljust(self.number_length, '_'), 2)
         self.ready = True
 
-    def update(self, conn, display, key_pressed):
+    def update(self, conn, display, key_pressed, steps=1):
         if not self.ready:
             return True
         if self.entry_complete:
@@ -159,14 +362,11 @@ class NumberEntryMenu(object):
             else:
                 self.current_digit = int(self.number_typed[-1:]) if self.number_typed[-1:] else 5
                 self.number_typed = self.number_typed[:-1]
+        # steps > 1 when several presses or auto-repeats were coalesced
         if key_pressed == ecodes.KEY_UP:
-            self.current_digit += 1
-            if self.current_digit > 9:
-                self.current_digit = 0
+            self.current_digit = (self.current_digit + steps) % 10
         if key_pressed == ecodes.KEY_DOWN:
-            self.current_digit -= 1
-            if self.current_digit < 0:
-                self.current_digit = 9
+            self.current_digit = (self.current_digit - steps) % 10
         if key_pressed:
             self.to_display = self.number_typed + str(self.current_digit)
             display.display_string(self.prompt_text, 1)
@@ -176,9 +376,9 @@ class NumberEntryMenu(object):
 
 class ServiceMenu(object):
 
-    def __init__(self, conn):
+    def __init__(self, conn, payg_service):
         self.conn = conn
-        self.payg_service = PAYGService(self.conn)
+        self.payg_service = payg_service
         self.password_entry_menu = NumberEntryMenu(conn, 6, 'Service Password', self.validate_password)
         self.lvd_entry_menu = NumberEntryMenu(conn, 5, 'LVD Thres. (mV):', self.save_lvd, starting_value_callback=self.get_lvd_string)
 
@@ -190,12 +390,12 @@ class ServiceMenu(object):
         self.lvd_set = None
         self.password_entry_menu.enter(conn, display)
 
-    def update(self, conn, display, key_pressed):
+    def update(self, conn, display, key_pressed, steps=1):
         if self.password_valid is None:
-            return self.password_entry_menu.update(conn, display, key_pressed)
+            return self.password_entry_menu.update(conn, display, key_pressed, steps)
         elif self.password_valid == True:
             if not self.lvd_set:
-                return self.lvd_entry_menu.update(conn, display, key_pressed)
+                return self.lvd_entry_menu.update(conn, display, key_pressed, steps)
             else:
                 if key_pressed:
                     return False
@@ -1,65 +1,161 @@
+import logging
 from evdev import ecodes
+from time import time
 from datetime import datetime, timedelta
-from four_button_pages import StaticMenu, TokenEntryMenu, PAYGStatusMenu, ServiceMenu
+from tracering import ring, KEY
+from payg_service import PAYGService
+from four_button_pages import StaticMenu, TokenEntryMenu, PAYGStatusMenu, ServiceMenu, SolarHistoryMenu, EventLogMenu
+
+NAVIGATION_KEYS = (ecodes.KEY_UP, ecodes.KEY_DOWN)
+
+# Auto-repeat acceleration: after holding a key for this many repeat
+# events, only every n-th repeat is turned into a step.
+REPEAT_ACCELERATION = ((25, 1), (10, 2), (0, 4))
+
+
+class LatencyMeter(object):
+    """ Keeps track of the time between the kernel timestamping a key event
+        and the LCD being updated, and complains when the budget is
+        exceeded. Time spent before the event is read counts too. """
+    def __init__(self, budget):
+        self.budget = budget
+        self.last = 0.0
+        self.worst = 0.0
+        self.count = 0
+        self.over_budget = 0
+
+    def record(self, latency):
+        self.last = latency
+        self.worst = max(self.worst, latency)
+        self.count += 1
+        if latency > self.budget:
+            self.over_budget += 1
+            logging.warning("Key to LCD latency {:.1f} ms exceeds budget of {:.0f} ms".format(
+                latency * 1000, self.budget * 1000))
 
 
 class FourButtonUserInterface(object):
 
     BACKLIGHT_TIMEOUT = 300
+    KEY_LATENCY_BUDGET = 0.05
 
-    def __init__(self, lcd, conn, kbd, static_pages):
+    def __init__(self, lcd, conn, kbd, static_pages, alarms):
         self.conn = conn
         self.disp = lcd
         self.kbd = kbd
         self.static_pages = static_pages
+        self.alarms = alarms
         self.last_key_pressed = datetime.now()
         self.selected_menu = None
         self.current_menu = None
         self.index = 0
         self.last_index = 1
         self.last_menu_number = 0
+        self.key_latency = LatencyMeter(self.KEY_LATENCY_BUDGET)
+        self._repeats = 0
+        self._available_menus = None
+        self._batch = False
+        self._pending_list = None
+        payg_service = PAYGService(self.conn)
         self.menus = [
-            ('PAYG Status', PAYGStatusMenu(self.conn)),
-            ('Enter Token', TokenEntryMenu(self.conn)),
-            ('LAN Status', StaticMenu(self.static_pages[16])),
-            ('WiFi Status', StaticMenu(self.static_pages[17])),
-            ('General Status', StaticMenu(self.static_pages[0])),
-            ('Solar Status', StaticMenu(self.static_pages[12])),
-            ('Battery Status', StaticMenu(self.static_pages[18])),
-            ('Solar History', StaticMenu(self.static_pages[14])),
-            ('Service Menu', ServiceMenu(self.conn)),
-        ]
-        self.alarm_menus = [
-            StaticMenu(self.static_pages[2]), # VE Bus error
-            StaticMenu(self.static_pages[3]),  # VE Bus alarm
-            StaticMenu(self.static_pages[13]),  # Solar error
+            ('PAYG Status', PAYGStatusMenu(self.conn, payg_service)),
+            ('Enter Token', TokenEntryMenu(self.conn, payg_service)),
+            ('LAN Status', StaticMenu(self.static_pages, 'LanPage')),
+            ('WiFi Status', StaticMenu(self.static_pages, 'WlanPage')),
+            ('General Status', StaticMenu(self.static_pages, 'StatusPage')),
+            ('Solar Status', StaticMenu(self.static_pages, 'SolarPage')),
+            ('Battery Status', StaticMenu(self.static_pages, 'DetailedBatteryPage')),
+            ('Solar History', SolarHistoryMenu(self.conn, self.static_pages, self.alarms)),
+            ('Event Log', EventLogMenu()),
+            ('Service Menu', ServiceMenu(self.conn, payg_service)),
         ]
 
     def start(self):
         self.disp.clear()
         self.update_menu_list()
+        self.alarms.update()
 
     def key_pressed(self):
         self.last_key_pressed = datetime.now()
-        for event in self.kbd.read():
-            if event.type == ecodes.EV_KEY and event.value == 1:
-                self.update_current_menu(event.code)
+        events = list(self.kbd.read())
+        actions = self.coalesce_keys(events)
+        if not actions:
+            return
+        # Event timestamps are wall clock time
+        started = min(event.timestamp() for event in events)
+        for key, steps in actions:
+            ring.add(KEY, key, steps)
+
+        # The first key press after an alarm pops up only hides it
+        if self.alarms.dismiss():
+            self.key_latency.record(time() - started)
+            return
+
+        # Handle all pending events as one batch: the list of available
+        # menus is evaluated once and the menu list is drawn at most once.
+        self._available_menus = None
+        self._batch = True
+        try:
+            for key_pressed, steps in actions:
+                self.update_current_menu(key_pressed, steps)
+        finally:
+            self._batch = False
+            pending, self._pending_list = self._pending_list, None
+        if pending is not None and self.current_menu is None:
+            self._draw_menu_list(*pending)
+
+        self.key_latency.record(time() - started)
+
+    def coalesce_keys(self, events):
+        """ Turn a burst of evdev events into a list of (key, steps) actions.
+            Consecutive up/down presses are folded into a net movement, and
+            auto-repeat events for up/down are accelerated while held. """
+        actions = []
+        for event in events:
+            if event.type != ecodes.EV_KEY:
+                continue
+            if event.value == 1:
+                self._repeats = 0
+            elif event.value == 2 and event.code in NAVIGATION_KEYS:
+                self._repeats += 1
+                if self._repeats % self._repeat_divisor(self._repeats):
+                    continue
+            else:
+                continue
+
+            key, steps = event.code, 1
+            if key in NAVIGATION_KEYS and actions and actions[-1][0] in NAVIGATION_KEYS:
+                last_key, last_steps = actions.pop()
+                net = (last_steps if last_key == ecodes.KEY_DOWN else -last_steps) + \
+                    (1 if key == ecodes.KEY_DOWN else -1)
+                if net == 0:
+                    continue
+                key, steps = (ecodes.KEY_DOWN, net) if net > 0 else (ecodes.KEY_UP, -net)
+            actions.append((key, steps))
+        return actions
+
+    def _repeat_divisor(self, repeats):
+        for threshold, divisor in REPEAT_ACCELERATION:
+            if repeats >= threshold:
+                return divisor
+        return 1
 
     def tick(self):
-        self.display_alarms()
-        self.update_current_menu(None)
+        self._available_menus = None
+        self.alarms.tick()
+        if not self.alarms.showing:
+            self.update_current_menu(None)
         self.update_backlight_status()
 
     def update_backlight_status(self):
         if self.last_key_pressed + timedelta(seconds=self.BACKLIGHT_TIMEOUT) < datetime.now():
+            if self.disp.on and isinstance(self.current_menu, StaticMenu):
+                # Nobody is looking, drop the subscriptions for the page
+                self.current_menu.leave()
             self.disp.on = False
         else:
             self.disp.on = True
 
-    def display_alarms(self):
-        for alarm in self.alarm_menus:
-            alarm.enter(self.conn, self.disp) # It will only display if the menu actually exists
-
     def get_available_menus(self):
         menus = []
         for menu in self.menus:
@@ -67,8 +163,15 @@ class FourButtonUserInterface(object):
                 menus.append(menu)
         return menus
 
+    def available_menus(self):
+        # Cached for the duration of a tick or a batch of key events, as
+        # checking availability involves blocking D-Bus queries.
+        if self._available_menus is None:
+            self._available_menus = self.get_available_menus()
+        return self._available_menus
+
     def update_menu_list(self):
-        menus = self.get_available_menus()
+        menus = self.available_menus()
 
         number_menus = len(menus)
         if number_menus < self.last_menu_number:
@@ -89,34 +192,42 @@ class FourButtonUserInterface(object):
                 top_string = menus[self.index - 1][0].ljust(15, ' ') + ' '
                 bottom_string = menus[self.index][0].ljust(15, ' ') + '>'
 
+        if self._batch:
+            self._pending_list = (top_string, bottom_string)
+        else:
+            self._draw_menu_list(top_string, bottom_string)
+
+        self.selected_menu = menus[self.index][1] if menus else None
+
+    def _draw_menu_list(self, top_string, bottom_string):
+        self.disp.page = 'MenuList'
         self.disp.display_string(top_string, 1)
         self.disp.display_string(bottom_string, 2)
 
-        self.selected_menu = menus[self.index][1]
-
-    def menu_list_loop(self, key_pressed):
-        number_of_menus = len(self.get_available_menus())
+    def menu_list_loop(self, key_pressed, steps=1):
+        number_of_menus = len(self.available_menus())
         if key_pressed == ecodes.KEY_UP:
             if self.index > 0:
                 self.last_index = self.index
-                self.index -= 1
-                self.update_menu_list()
+                self.index = max(0, self.index - steps)
         if key_pressed == ecodes.KEY_DOWN:
             if self.index < number_of_menus - 1:
                 self.last_index = self.index
-                self.index += 1
-                self.update_menu_list()
+                self.index = min(number_of_menus - 1, self.index + steps)
         if key_pressed == ecodes.KEY_RIGHT:
-            self.current_menu = self.selected_menu
-            self.current_menu.enter(self.conn, self.disp)
+            if self.selected_menu is not None:
+                self.current_menu = self.selected_menu
+                # Menus that show a page set it to the page instead
+                self.disp.page = type(self.current_menu).__name__
+                self.current_menu.enter(self.conn, self.disp)
         else:
             self.update_menu_list()
 
-    def update_current_menu(self, key_pressed):
-        if self.current_menu is not None and not self.current_menu.update(self.conn, self.disp, key_pressed):
+    def update_current_menu(self, key_pressed, steps=1):
+        if self.current_menu is not None and not self.current_menu.update(self.conn, self.disp, key_pressed, steps):
             self.current_menu = None
             key_pressed = None
             self.disp.clear()
             self.update_menu_list()
         if self.current_menu is None:
-            self.menu_list_loop(key_pressed)
+            self.menu_list_loop(key_pressed, steps)
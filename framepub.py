@@ -0,0 +1,113 @@
+import os
+import socket
+import struct
+from gi.repository import GLib
+from glyphs import fallback
+
+# Every message is a 16-bit big-endian length followed by:
+#   type      b'K' (keyframe) or b'D' (delta)
+#   backlight 1 byte, 0 or 1
+#   page id   1 byte length + utf-8
+#   spans     1 byte count, each span is row, column, byte length + utf-8
+# A keyframe has one span per row, a delta only spans of changed cells.
+KEYFRAME = b'K'
+DELTA = b'D'
+
+def _pack_str(s):
+	b = s.encode('utf-8')[:255]
+	return struct.pack('!B', len(b)) + b
+
+def encode(kind, backlight, page, spans):
+	body = kind + struct.pack('!B', bool(backlight)) + _pack_str(page or '') + \
+		struct.pack('!B', len(spans)) + \
+		b''.join(struct.pack('!BB', row, col) + _pack_str(text) for row, col, text in spans)
+	return struct.pack('!H', len(body)) + body
+
+def diff(old, new):
+	# Returns (column, text) covering the cells that differ, or None
+	if len(old) != len(new):
+		return 0, new
+	changed = [i for i, (a, b) in enumerate(zip(old, new)) if a != b]
+	if not changed:
+		return None
+	return changed[0], new[changed[0]:changed[-1] + 1]
+
+class FramePublisher(object):
+	""" Streams what is on the display to subscribers on a unix socket. New
+	    subscribers get a keyframe, after that only changes are sent. Frames
+	    are published from idle, once per batch of writes. Subscribers that
+	    cannot keep up are dropped rather than slowing down the main loop. """
+	MAX_SUBSCRIBERS = 16
+
+	def __init__(self, lcd, path, rows=2, cols=16):
+		self.lcd = lcd
+		self.path = path
+		self.blank = ' ' * cols
+		self.rows = [self.blank] * rows
+		self.backlight = None
+		self.page = None
+		self.subscribers = []
+		self.pending = None
+
+		try:
+			os.unlink(path)
+		except OSError:
+			pass
+		self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.server.bind(path)
+		self.server.listen(4)
+		self.server.setblocking(False)
+		GLib.io_add_watch(self.server.fileno(), GLib.IO_IN, self._accept)
+
+	def _accept(self, fd, condition):
+		try:
+			sock, _ = self.server.accept()
+		except OSError:
+			return True
+
+		if len(self.subscribers) >= self.MAX_SUBSCRIBERS:
+			sock.close()
+			return True
+
+		sock.setblocking(False)
+		spans = [(row, 0, text) for row, text in enumerate(self.rows)]
+		if self._send(sock, encode(KEYFRAME, self.backlight, self.page, spans)):
+			self.subscribers.append(sock)
+		return True
+
+	def _send(self, sock, msg):
+		try:
+			if sock.send(msg) == len(msg):
+				return True
+		except OSError:
+			pass
+		# Partial write or full buffer, the subscriber is too slow
+		sock.close()
+		return False
+
+	def changed(self):
+		if self.pending is None:
+			self.pending = GLib.idle_add(self.publish)
+
+	def publish(self):
+		self.pending = None
+		# A row that was not written since a clear is blank
+		rows = [fallback(self.lcd.frames.get(row + 1, self.blank)) for row in range(len(self.rows))]
+		spans = []
+		for row, (old, new) in enumerate(zip(self.rows, rows)):
+			d = diff(old, new)
+			if d is not None:
+				spans.append((row, d[0], d[1]))
+		backlight = self.lcd.on
+		page = self.lcd.page
+		self.rows = rows
+
+		if not spans and backlight == self.backlight and page == self.page:
+			return False
+		self.backlight = backlight
+		self.page = page
+
+		if self.subscribers:
+			msg = encode(DELTA, backlight, page, spans)
+			self.subscribers = [s for s in self.subscribers if self._send(s, msg)]
+		return False
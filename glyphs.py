@@ -0,0 +1,91 @@
+from collections import OrderedDict
+
+CGRAM_SLOTS = 8
+GLYPH_BASE = 0xE000 # Glyphs travel through page text as private-use characters
+
+# Custom 5x8 characters, one row per byte. The last element is what is
+# shown on displays that have no CGRAM, like the debug display.
+_definitions = [
+	("bar1", (0x10,) * 7 + (0x00,), "."),
+	("bar2", (0x18,) * 7 + (0x00,), ":"),
+	("bar3", (0x1C,) * 7 + (0x00,), "|"),
+	("bar4", (0x1E,) * 7 + (0x00,), "|"),
+	("bar5", (0x1F,) * 7 + (0x00,), "#"),
+	("up", (0x04, 0x0E, 0x15, 0x04, 0x04, 0x04, 0x04, 0x00), "^"),
+	("down", (0x04, 0x04, 0x04, 0x04, 0x15, 0x0E, 0x04, 0x00), "v"),
+]
+
+GLYPHS = {name: chr(GLYPH_BASE + i) for i, (name, _, _) in enumerate(_definitions)}
+_bitmaps = {chr(GLYPH_BASE + i): bitmap for i, (_, bitmap, _) in enumerate(_definitions)}
+_fallbacks = {GLYPH_BASE + i: fallback for i, (_, _, fallback) in enumerate(_definitions)}
+
+def glyph(name):
+	return GLYPHS[name]
+
+def bar(fraction, width):
+	""" Returns a bar graph `width` cells wide, filled for `fraction`, at a
+	    resolution of one pixel column. Uses at most two distinct glyphs. """
+	fraction = min(1.0, max(0.0, fraction or 0.0))
+	columns = int(round(fraction * width * 5))
+	full, part = divmod(columns, 5)
+	text = GLYPHS["bar5"] * full
+	if part:
+		text += GLYPHS["bar{}".format(part)]
+	return text.ljust(width)
+
+def fallback(string):
+	# Replace glyphs with plain ascii
+	return string.translate(_fallbacks)
+
+class GlyphManager(object):
+	""" Maps glyphs onto the 8 CGRAM slots of the display. Slots are reused
+	    in least recently used order, skipping glyphs that are visible on
+	    another line, and a slot is only uploaded when its contents change,
+	    as that is slow on this hardware. """
+	def __init__(self, upload):
+		self.upload = upload
+		self.slots = OrderedDict() # glyph -> slot, least recently used first
+		self.contents = [None] * CGRAM_SLOTS # bitmap currently in each slot
+		self.visible = {}
+		self.uploads = 0
+
+	def translate(self, string, line):
+		""" Returns string with glyphs replaced by CGRAM character codes,
+		    uploading glyphs as needed. """
+		used = set(c for c in string if c in _bitmaps)
+		self.visible[line] = used
+		if not used:
+			return string
+
+		pinned = set().union(*self.visible.values())
+		table = {}
+		for g in used:
+			slot = self._slot(g, pinned)
+			table[ord(g)] = _fallbacks[ord(g)] if slot is None else chr(slot)
+		return string.translate(table)
+
+	def _slot(self, g, pinned):
+		if g in self.slots:
+			self.slots.move_to_end(g)
+			return self.slots[g]
+
+		bitmap = _bitmaps[g]
+		if bitmap in self.contents:
+			slot = self.contents.index(bitmap)
+		elif None in self.contents:
+			slot = self.contents.index(None)
+		else:
+			victim = next((v for v in self.slots if v not in pinned), None)
+			if victim is None:
+				return None # All slots are on screen
+			slot = self.slots.pop(victim)
+
+		for other, s in list(self.slots.items()):
+			if s == slot:
+				del self.slots[other]
+		self.slots[g] = slot
+		if self.contents[slot] != bitmap:
+			self.contents[slot] = bitmap
+			self.uploads += 1
+			self.upload(slot, bitmap)
+		return slot
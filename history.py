@@ -0,0 +1,101 @@
+from array import array
+from time import time, localtime
+
+class Series(object):
+	""" Fixed-size history of a single value, kept in a ring of time slots
+	    of `resolution` seconds each. Every slot holds the min, max, sum and
+	    number of samples that arrived in it, so memory use is fixed at
+	    length * 18 bytes (26 kB for the default 24 hours at 1 minute).
+
+	    Today's min/max/avg are kept as running values and cost O(1) per
+	    sample and per query. Windowed views scan at most window/resolution
+	    slots. """
+	def __init__(self, resolution=60, length=1440):
+		self.resolution = resolution
+		self.length = length
+		self.slots = array('i', [-1]) * length
+		self.mins = array('f', [0.0]) * length
+		self.maxs = array('f', [0.0]) * length
+		self.sums = array('f', [0.0]) * length
+		self.counts = array('H', [0]) * length
+		self.slot = -1
+		self.day = None
+		self.reset_today()
+
+	@property
+	def size(self):
+		# Bytes used by the ring buffers
+		return sum(a.itemsize * len(a) for a in (
+			self.slots, self.mins, self.maxs, self.sums, self.counts))
+
+	def reset_today(self):
+		self.today_min = None
+		self.today_max = None
+		self._today_sum = 0.0
+		self._today_count = 0
+
+	@property
+	def today_avg(self):
+		if self._today_count:
+			return self._today_sum / self._today_count
+		return None
+
+	def add(self, value, now=None):
+		if value is None:
+			return
+		now = time() if now is None else now
+		slot = int(now // self.resolution)
+		i = slot % self.length
+
+		if slot != self.slot:
+			self.slot = slot
+			day = localtime(now)[:3]
+			if day != self.day:
+				self.day = day
+				self.reset_today()
+			if self.slots[i] != slot:
+				self.slots[i] = slot
+				self.mins[i] = self.maxs[i] = self.sums[i] = value
+				self.counts[i] = 1
+				self._add_today(value)
+				return
+
+		if value < self.mins[i]:
+			self.mins[i] = value
+		if value > self.maxs[i]:
+			self.maxs[i] = value
+		self.sums[i] += value
+		if self.counts[i] < 0xFFFF:
+			self.counts[i] += 1
+		self._add_today(value)
+
+	def _add_today(self, value):
+		if self.today_min is None or value < self.today_min:
+			self.today_min = value
+		if self.today_max is None or value > self.today_max:
+			self.today_max = value
+		self._today_sum += value
+		self._today_count += 1
+
+	def window(self, seconds, now=None):
+		""" Returns (min, max, avg) over the last `seconds`, or None if there
+		    are no samples in that period. """
+		now = time() if now is None else now
+		last = int(now // self.resolution)
+		first = max(last - self.length + 1, last - int(seconds // self.resolution))
+		lo = hi = None
+		total = 0.0
+		count = 0
+		for slot in range(first, last + 1):
+			i = slot % self.length
+			if self.slots[i] != slot:
+				continue
+			if lo is None or self.mins[i] < lo:
+				lo = self.mins[i]
+			if hi is None or self.maxs[i] > hi:
+				hi = self.maxs[i]
+			total += self.sums[i]
+			count += self.counts[i]
+		if count == 0:
+			return None
+		return lo, hi, total / count
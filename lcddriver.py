@@ -2,6 +2,11 @@ import sys
 import subprocess
 import os
 import os.path
+import re
+from time import monotonic
+from glyphs import GlyphManager, fallback
+from marquee import Marquee
+from tracering import ring, LCD_WRITE
 
 # commands
 LCD_CLEARDISPLAY = '\014'
@@ -9,6 +14,7 @@ LCD_RETURNHOME = '\033[H'
 LCD_XY = '\033[Lx%dy%d;'
 LCD_BACKLIGHT_ON = '\033[L+'
 LCD_BACKLIGHT_OFF = '\033[L-'
+LCD_GENERATE = '\033[LG%d%s;'
 
 PWM_BACKLIGHT = '/sys/class/backlight/gxdisp-0-0051'
 PWM_BRIGHTNESS_ON = 15
@@ -16,10 +22,16 @@ PWM_BRIGHTNESS_OFF = 1
 ADC_DAYLIGHT = 200
 
 class Lcd(object):
+	page = None
+	publisher = None
+
 	#initializes objects and lcd
 	def __init__(self, lcd_dev):
 		self.lcd = os.open(lcd_dev, os.O_WRONLY)
 		self._backlight_on = True
+		self.glyphs = GlyphManager(self.define_glyph)
+		self.marquee = Marquee(self)
+		self.frames = {}
 		self.pwm_backlight = os.path.exists(PWM_BACKLIGHT)
 		if self.pwm_backlight:
 			self.write_attr('auto_brightness', 0)
@@ -27,6 +39,7 @@ class Lcd(object):
 			self.on_gpio(True)
 
 	def write(self, data):
+		ring.add(LCD_WRITE, self.page or "", len(data))
 		os.write(self.lcd, data)
 
 	def write_string(self, str):
@@ -39,12 +52,52 @@ class Lcd(object):
 
 	# put string function
 	def display_string(self, string, line):
+		if not self.marquee.display(string, line):
+			return
+		if self.frames.get(line) == string:
+			return # Already on the display
+		self.frames[line] = string
+		string = self.glyphs.translate(string, line)
 		self.write_string(LCD_XY % (0, line - 1))
 		self.write_string(string)
+		self.changed()
+
+	# rewrite only the cells that differ from what is on the display
+	def update_string(self, string, line):
+		old = self.frames.get(line)
+		if old is None or len(old) != len(string):
+			first, last = 0, len(string)
+		else:
+			changed = [i for i, (a, b) in enumerate(zip(old, string)) if a != b]
+			if not changed:
+				return
+			first, last = changed[0], changed[-1] + 1
+		self.frames[line] = string
+		string = self.glyphs.translate(string, line)
+		self.write_string(LCD_XY % (first, line - 1))
+		self.write_string(string[first:last])
+		self.changed()
+
+	# write lines rendered ahead of time, only the cells that differ
+	def display_frame(self, lines):
+		for row, string in enumerate(lines, 1):
+			if self.marquee.display(string, row):
+				self.update_string(string, row)
+
+	def changed(self):
+		if self.publisher is not None:
+			self.publisher.changed()
+
+	# load a 5x8 character into CGRAM slot 0-7
+	def define_glyph(self, slot, bitmap):
+		self.write_string(LCD_GENERATE % (slot, ''.join('%02X' % row for row in bitmap)))
 
 	# clear lcd and set to home
 	def clear(self):
+		self.marquee.stop()
+		self.frames.clear()
 		self.write_string(LCD_CLEARDISPLAY)
+		self.changed()
 
 	@property
 	def on(self):
@@ -55,11 +108,13 @@ class Lcd(object):
 		self._backlight_on = bool(v)
 		if v:
 			self.write_string(LCD_RETURNHOME)
+			self.marquee.resume()
 
 		if self.pwm_backlight:
 			self.on_pwm(v)
 		else:
 			self.on_gpio(v)
+		self.changed()
 
 	def on_pwm(self, v):
 		if v:
@@ -110,24 +165,134 @@ class Lcd(object):
 
 class DebugLcd(Lcd):
 	def __init__(self):
-		pass
+		self.frames = {}
+		self._backlight_on = True
 
 	def display_string(self, string, line):
+		self.frames[line] = string
+		self.changed()
 		if line == 1:
 			print('|' + '-'*16 + '|')
-		print('|' + string + '|')
+		print('|' + fallback(string) + '|')
+
+	def display_frame(self, lines):
+		for row, string in enumerate(lines, 1):
+			self.display_string(string, row)
 
 	def clear(self):
-		pass
+		self.frames.clear()
+		self.changed()
 
 	@property
 	def on(self):
-		pass
+		return self._backlight_on
 
 	@on.setter
 	def on(self, v):
+		self._backlight_on = bool(v)
+
+	@property
+	def daylight(self):
+		return True
+
+class VirtualLcd(Lcd):
+	""" Emulates what the HD44780 behind /dev/lcd would show, by parsing the
+	    bytes Lcd writes, and counts what the output costs. Used for tests
+	    and benchmarks. Every byte that is not part of an escape sequence
+	    takes a cell, as it would on the real display. """
+	ROWS = 2
+	COLS = 16
+	_escape = re.compile(br'\033\[(H|L[+-]|Lx(\d+)y(\d+);|LG([0-7])([0-9A-Fa-f]{16});|L.|[^L])')
+	_incomplete = re.compile(br'\033(\[(L([xG][^;]*)?)?)?$')
+
+	def __init__(self):
+		self._backlight_on = True
+		self.pwm_backlight = False
+		self.glyphs = GlyphManager(self.define_glyph)
+		self.marquee = Marquee(self)
+		self.frames = {}
+		self.cgram = [None] * 8
+		self.pending = b''
+		self.cells = [bytearray(b' ' * self.COLS) for _ in range(self.ROWS)]
+		self.x = self.y = 0
+		self.backlight = True
+		self.reset_stats()
+
+	def reset_stats(self):
+		self.started = monotonic()
+		self.stats = dict.fromkeys(("writes", "bytes", "chars", "cursor_moves",
+			"clears", "backlight_toggles", "glyph_uploads", "unknown"), 0)
+
+	def rates(self):
+		# Statistics per second since the last reset
+		elapsed = max(monotonic() - self.started, 1e-9)
+		return {k: v / elapsed for k, v in self.stats.items()}
+
+	@property
+	def lines(self):
+		return [row.decode('latin-1') for row in self.cells]
+
+	def write_attr(self, attr, val):
 		pass
 
+	def write(self, data):
+		self.stats["writes"] += 1
+		self.stats["bytes"] += len(data)
+		data = self.pending + data
+		self.pending = b''
+		i = 0
+		while i < len(data):
+			c = data[i]
+			if c == 0x1B:
+				if self._incomplete.match(data, i):
+					self.pending = data[i:] # rest follows in the next write
+					return
+				m = self._escape.match(data, i)
+				if m is None:
+					self.stats["unknown"] += 1
+					i += 1
+					continue
+				self._command(m)
+				i = m.end()
+				continue
+			if c == 0x0C:
+				self.stats["clears"] += 1
+				for row in self.cells:
+					row[:] = b' ' * self.COLS
+				self.x = self.y = 0
+			elif c == 0x0D:
+				self.x = 0
+			elif c == 0x0A:
+				self.x, self.y = 0, (self.y + 1) % self.ROWS
+			elif c == 0x08:
+				self.x = max(0, self.x - 1)
+			else:
+				self.stats["chars"] += 1
+				if self.x < self.COLS:
+					self.cells[self.y][self.x] = c
+				self.x += 1
+			i += 1
+
+	def _command(self, m):
+		cmd = m.group(1)
+		if cmd == b'H':
+			self.stats["cursor_moves"] += 1
+			self.x = self.y = 0
+		elif cmd in (b'L+', b'L-'):
+			on = cmd == b'L+'
+			if on != self.backlight:
+				self.stats["backlight_toggles"] += 1
+			self.backlight = on
+		elif m.group(2) is not None:
+			self.stats["cursor_moves"] += 1
+			self.x = int(m.group(2))
+			self.y = min(int(m.group(3)), self.ROWS - 1)
+		elif m.group(4) is not None:
+			self.stats["glyph_uploads"] += 1
+			self.cgram[int(m.group(4))] = bytes.fromhex(m.group(5).decode('ascii'))
+		else:
+			self.stats["unknown"] += 1
+
 	@property
 	def daylight(self):
 		return True
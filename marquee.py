@@ -0,0 +1,67 @@
+from gi.repository import GLib
+
+SCROLL_GAP = 3
+
+class ScrollingLine(str):
+	""" A display line with a field that does not fit. The string value is
+	    the first frame, so it can be written like any other line. Everything
+	    between the `fixed` prefix and the `suffix` scrolls. """
+	def __new__(cls, fixed, text, width, suffix=""):
+		span = width - len(fixed) - len(suffix)
+		self = str.__new__(cls, fixed + text[:span] + suffix)
+		self.fixed = fixed
+		self.text = text + " " * SCROLL_GAP
+		self.width = width
+		self.suffix = suffix
+		return self
+
+	@property
+	def key(self):
+		return (self.fixed, self.text, self.suffix)
+
+	def frame(self, offset):
+		span = self.width - len(self.fixed) - len(self.suffix)
+		offset %= len(self.text)
+		return self.fixed + (self.text + self.text)[offset:offset + span] + self.suffix
+
+class Marquee(object):
+	""" Scrolls lines that are too long for the display. Each step only
+	    rewrites the cells that changed, and scrolling stops while the
+	    backlight is off. """
+	INTERVAL = 400 # ms
+
+	def __init__(self, lcd):
+		self.lcd = lcd
+		self.interval = self.INTERVAL
+		self.lines = {} # line -> [ScrollingLine, offset]
+		self.timer = None
+
+	def display(self, string, line):
+		""" Called for every line written. Returns False if the line is
+		    already being scrolled, so there is no need to write it. """
+		if isinstance(string, ScrollingLine):
+			current = self.lines.get(line)
+			if current is not None and current[0].key == string.key:
+				return False
+			self.lines[line] = [string, 0]
+			self.resume()
+		else:
+			self.lines.pop(line, None)
+		return True
+
+	def stop(self):
+		self.lines.clear()
+
+	def resume(self):
+		if self.timer is None and self.lines:
+			self.timer = GLib.timeout_add(self.interval, self.step)
+
+	def step(self):
+		if not self.lines or not self.lcd.on:
+			self.timer = None
+			return False
+
+		for line, state in self.lines.items():
+			state[1] += 1
+			self.lcd.update_string(state[0].frame(state[1]), line)
+		return True
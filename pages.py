@@ -1,21 +1,30 @@
 import logging
+from time import monotonic
 from functools import partial
-from itertools import count
 from collections import defaultdict
 from cache import smart_dict
 from track import Tracker
-import dbus
+from history import Series
+from glyphs import glyph, bar
+from marquee import ScrollingLine
+from derived import product, reason_codes
+from tracering import ring, RENDER
+import eventlog
+import dbuscall
 
 DISPLAY_COLS = 16
 DISPLAY_ROWS = 2
+CONNMAN_TIMEOUT_MS = 500
+STALE_MARKER = "*"
 
 def get_ipparams(conn, interface):
 	# Fetch IP params from conmann dbus for given interface (ethernet, wifi)
 
 	ip_params = {}
-	manager = dbus.Interface(conn.get_object("net.connman", "/"), "net.connman.Manager")
+	services = dbuscall.call_blocking(conn, "net.connman", "/", "net.connman.Manager",
+		"GetServices", timeout_ms=CONNMAN_TIMEOUT_MS)
 
-	for path, properties in manager.GetServices():
+	for path, properties in services:
 		if path.startswith('/net/connman/service/' + interface):
 			for ip_version in ['IPv4', 'IPv6']:
 				if ip_version in properties:
@@ -28,24 +37,39 @@ def get_ipparams(conn, interface):
 	return ip_params
 
 
-def format_line(line):
+def format_line(line, suffix=""):
+	# The suffix takes the last cells, the fields get the rest
+	width = DISPLAY_COLS - len(suffix)
 	if (line and line[0] is not None):
-		pad = DISPLAY_COLS - len(line[0])
+		head = line[0]
+		if len(head) > width:
+			head = head.rstrip() # centered text, the padding can go
+		pad = width - len(head)
 
+		# Fields that do not fit are scrolled
 		if (pad < 0):
-			return ("{:.{}}").format(line[0], DISPLAY_COLS)
+			return ScrollingLine("", " ".join(f for f in line if f), DISPLAY_COLS, suffix)
 		elif (len(line[1]) > pad):
-			return ("{}{:.{}}").format(line[0], line[1], pad)
+			return ScrollingLine(head, line[1], DISPLAY_COLS, suffix)
 		else:
-			return ("{}{:>{}}").format(line[0], line[1], pad)
+			return ("{}{:>{}}").format(head, line[1], pad) + suffix
 
-	return " "*DISPLAY_COLS
+	return " "*width + suffix
 
 
 class Page(Tracker):
 	# Subclasses can override
 	_auto = True
 
+	# When set, error and alarm transitions are logged to this EventLog
+	events = None
+
+	# Lines are shared by displays that show the page within this many
+	# seconds of each other, as long as no value changed in between
+	FRAME_REUSE = 0.5
+	updates = 0
+	_frame = None
+
 	@property
 	def auto(self):
 		""" Returns true if this screen should be shown as part
@@ -53,25 +77,59 @@ class Page(Tracker):
 			false screen can only be reached using the button. """
 		return self._auto
 
+	@property
+	def name(self):
+		return self.__class__.__name__
+
 	def setup(self, conn, name):
 		pass
 
 	def get_text(self, conn):
 		return [["", ""], ["", ""]]
 
+	def render(self, conn=None):
+		""" Returns the formatted display lines, or None if this page has
+		    nothing to show. Pages that only read their cache do not need
+		    a bus connection. """
+		text = self.get_text(conn)
+		if text is None:
+			return None
+		# Values restored from a snapshot and not confirmed yet are marked
+		# in the last cell, the top line gives up that cell for it
+		lines = [format_line(text[row], STALE_MARKER if self.stale and row == 0 else "")
+			for row in range(0, DISPLAY_ROWS)]
+		return lines
+
+	def update_cache(self, callback, key, v):
+		self.updates += 1
+		super(Page, self).update_cache(callback, key, v)
+
+	def frame(self, conn=None):
+		""" Like render, but reuses the lines rendered for another display
+		    if they are recent and no value changed since. """
+		now = monotonic()
+		if self._frame is not None:
+			updates, rendered, lines = self._frame
+			if updates == self.updates and now - rendered < self.FRAME_REUSE:
+				return lines
+		lines = self.render(conn)
+		ring.add(RENDER, self.name, monotonic() - now)
+		self._frame = (self.updates, now, lines)
+		return lines
+
 	def display(self, conn, lcd):
 		try:
-			text = self.get_text(conn)
+			lines = self.frame(conn)
 		except Exception as e:
 			logging.exception("Exception showing page")
 			return False
 
-		if text is None:
+		if lines is None:
 			return False
 
 		# Display text
-		for row in range(0, DISPLAY_ROWS):
-			line = format_line(text[row])
+		lcd.page = self.name
+		for row, line in enumerate(lines):
 			lcd.display_string(line, row + 1)
 
 		return True
@@ -125,6 +183,8 @@ class ReasonPage(StatusPage):
 		super(ReasonPage, self).__init__()
 		self.cache.systemname = None
 		self.cache.bl = None
+		self.derive("reason", ("ls", "bl", "cd", "dd", "sc", "ucl", "udl"),
+			reason_codes)
 
 	def setup(self, conn, name):
 		if name == "com.victronenergy.system":
@@ -144,61 +204,128 @@ class ReasonPage(StatusPage):
 			# This should only happen if systemcalc is dead
 			return None
 
-		reasons = ("{:X}".format(reason) for reason, v in zip(count(1), (
-			self.cache.ls, self.cache.bl,
-			self.cache.cd, self.cache.dd, self.cache.sc, self.cache.ucl,
-			self.cache.udl)) if v)
-		reasons = ",".join(reasons)
-		text = "#" + reasons if reasons else ""
-
 		# Skip this page if no reasons to display
-		if text:
+		if self.cache.reason:
 			return [[self.format(self.cache.systemname or self.cache.systemtype or "Status"), ""],
-				[self.format(text), ""]]
+				[self.format(self.cache.reason), ""]]
 		return None
 
 
+# VE.Bus alarms in order of priority. Each alarm/phase gets a bit, the
+# lowest set bit being the most important active alarm.
+VEBUS_PHASE_ALARMS = ("HighTemperature", "LowBattery", "Overload", "Ripple")
+VEBUS_ALARMS = ("TemperatureSensor", "VoltageSensor")
+VEBUS_ALARM_BITS = [("/Alarms/L{}/{}".format(phase, alarm), alarm, phase)
+	for alarm in VEBUS_PHASE_ALARMS for phase in range(1, 4)] + \
+	[("/Alarms/{}".format(alarm), alarm, None) for alarm in VEBUS_ALARMS]
+
+def vebus_alarm_names():
+	# Translated when called, the language is installed after import
+	return {
+		"HighTemperature": _("High temp"),
+		"LowBattery": _("Low battery"),
+		"Overload": _("Overload"),
+		"Ripple": _("High ripple"),
+		"TemperatureSensor": _("Temp Sense"),
+		"VoltageSensor": _("Volt sense"),
+	}
+
 class VebusAlarmsPage(Page):
+	CYCLE_INTERVAL = 3
+
 	def __init__(self):
 		super(VebusAlarmsPage, self).__init__()
-		self.alarms = {
-			"HighTemperature": _("High temp"),
-			"LowBattery": _("Low battery"),
-			"Overload": _("Overload"),
-			"Ripple": _("High ripple"),
-			"TemperatureSensor": _("Temp Sense"),
-			"VoltageSensor": _("Volt sense"),
-		}
+		self.alarms = vebus_alarm_names()
+		self.masks = {} # service -> bitmask of active alarms
+		self.seen = {} # service -> bits that had a value, to log changes only
+		self.combined = 0
 
 	def setup(self, conn, name):
 		if name.startswith("com.victronenergy.vebus."):
-			for phase in range(1, 4):
-				for alarm in ("HighTemperature", "LowBattery",
-						"Overload", "Ripple"):
-					path = "/Alarms/L{}/{}".format(phase, alarm)
-					self.track(conn, name, path, path)
-			for alarm in ("TemperatureSensor", "VoltageSensor"):
-				path = "/Alarms/{}".format(alarm)
-				self.track(conn, name, path, path)
-				self.track(conn, name, path, path)
-
-	def get_text(self, conn):
-		alarms = []
-		for alarm in ("HighTemperature", "LowBattery",
-					"Overload", "Ripple"):
-			paths = ["/Alarms/L{}/{}".format(phase, alarm) for phase in range(1, 4)]
-			if any((self.cache.get(p, None) for p in paths)):
-				alarms.append(alarm)
+			self.masks[name] = 0
+			self.seen[name] = 0
+			for bit, (path, alarm, phase) in enumerate(VEBUS_ALARM_BITS):
+				self.track(conn, name, path, (name, path),
+					partial(self.update_alarm, name, 1 << bit))
+
+	def cleanup(self, name):
+		super(VebusAlarmsPage, self).cleanup(name)
+		self.seen.pop(name, None)
+		if self.masks.pop(name, None) is not None:
+			self.update_combined()
+
+	def update_alarm(self, name, bit, v):
+		if name not in self.masks:
+			return
+		mask = self.masks[name]
+		if v:
+			self.masks[name] |= bit
+		else:
+			self.masks[name] &= ~bit
+		seen = self.seen[name] & bit
+		self.seen[name] |= bit
+		if self.events is not None and seen and mask != self.masks[name]:
+			self.events.log(eventlog.VEBUS_ALARM, name, bit.bit_length() - 1, v)
+		self.update_combined()
+
+	def update_combined(self):
+		combined = 0
+		for mask in self.masks.values():
+			combined |= mask
+		self.combined = combined
 
-		for alarm in ("TemperatureSensor", "VoltageSensor"):
-			if self.cache.get("/Alarms/{}".format(alarm), None):
-				alarms.append(alarm)
+	@property
+	def any_alarm(self):
+		return self.combined != 0
 
-		if alarms:
-			return [["Alarm:", ""], [self.alarms.get(alarms[0], ""), ""]]
+	@property
+	def highest_alarm(self):
+		# Path, alarm and phase of the most important active alarm
+		if not self.combined:
+			return None
+		return VEBUS_ALARM_BITS[(self.combined & -self.combined).bit_length() - 1]
+
+	def active_alarms(self):
+		""" Returns (service, path, alarm, phase) for all active alarms on all
+		    inverters, most important first. """
+		active = []
+		for bit, entry in enumerate(VEBUS_ALARM_BITS):
+			if self.combined & (1 << bit):
+				for name in sorted(self.masks):
+					if self.masks[name] & (1 << bit):
+						active.append((name, ) + entry)
+		return active
 
-		return None
+	def get_text(self, conn):
+		if not self.combined:
+			return None
 
+		# Cycle through all active alarms
+		active = self.active_alarms()
+		name, path, alarm, phase = active[int(monotonic() / self.CYCLE_INTERVAL) % len(active)]
+		where = "L{}".format(phase) if phase else ""
+		if len(self.masks) > 1:
+			where = "#{} {}".format(sorted(self.masks).index(name) + 1, where).strip()
+		if len(active) > 1:
+			where = "{}/{} {}".format(active.index((name, path, alarm, phase)) + 1,
+				len(active), where).strip()
+		return [["Alarm:", where], [self.alarms.get(alarm, ""), ""]]
+
+
+def log_error(page, kind, name, code):
+	# Logs the error a service reports now and the one it replaces. The
+	# first value is what the service had before, it is not logged.
+	code = code or 0
+	if name not in page.errors_seen:
+		page.errors_seen[name] = code
+		return
+	previous = page.errors_seen[name]
+	page.errors_seen[name] = code
+	if page.events is not None and code != previous:
+		if previous:
+			page.events.log(kind, name, previous, False)
+		if code:
+			page.events.log(kind, name, code, True)
 
 class VebusErrorPage(Page):
 	def __init__(self):
@@ -223,10 +350,12 @@ class VebusErrorPage(Page):
 			26: _("Internal error")
 		}
 		self.cache.vebus_error = None
+		self.errors_seen = {}
 
 	def setup(self, conn, name):
 		if name.startswith("com.victronenergy.vebus."):
-			self.track(conn, name, "/VebusError", "vebus_error")
+			self.track(conn, name, "/VebusError", "vebus_error",
+				partial(log_error, self, eventlog.VEBUS_ERROR, name))
 
 	def get_text(self, conn):
 		if self.cache.vebus_error is not None and self.cache.vebus_error > 0:
@@ -266,10 +395,12 @@ class SolarErrorPage(Page):
 			119: _("Settings lost")
 		}
 		self.cache.mppt_error = None
+		self.errors_seen = {}
 
 	def setup(self, conn, name):
 		if name.startswith("com.victronenergy.solarcharger."):
-			self.track(conn, name, "/ErrorCode", "mppt_error")
+			self.track(conn, name, "/ErrorCode", "mppt_error",
+				partial(log_error, self, eventlog.SOLAR_ERROR, name))
 
 	def get_text(self, conn):
 		if self.cache.mppt_error is not None and self.cache.mppt_error > 0:
@@ -287,9 +418,9 @@ class BatteryPage(Page):
 
 	def setup(self, conn, name):
 		if name == "com.victronenergy.system":
-			self.track(conn, name, "/Dc/Battery/Voltage", "battery_voltage")
+			self.track(conn, name, "/Dc/Battery/Voltage", "battery_voltage", demand=True)
 			self.track(conn, name, "/Dc/Battery/Soc", "battery_soc")
-			self.track(conn, name, "/Dc/Battery/Power", "battery_power")
+			self.track(conn, name, "/Dc/Battery/Power", "battery_power", demand=True)
 
 
 	def get_text(self, conn):
@@ -305,16 +436,31 @@ class BatteryPage(Page):
 			text[1][1] = "{:.1f} V".format(self.cache.battery_voltage)
 		return text
 
+class BatteryBarPage(BatteryPage):
+	# Bar graph variant, with an arrow showing the direction of the current
+	name = "BatteryPage"
+
+	def get_text(self, conn):
+		if self.cache.battery_soc is None:
+			return None
+
+		head = _("Battery") + ":"
+		if self.cache.battery_power:
+			head += glyph("up" if self.cache.battery_power > 0 else "down")
+		return [[head, "{:.1f} %".format(self.cache.battery_soc)],
+			[bar(self.cache.battery_soc / 100.0, DISPLAY_COLS), ""]]
+
 class DetailedBatteryPage(Page):
 	def __init__(self):
 		super(DetailedBatteryPage, self).__init__()
 		self.cache.mppt_connected = None
+		self.derive("battery_power", ("battery_voltage", "battery_current"), product)
 
 	def setup(self, conn, name):
 		if name.startswith("com.victronenergy.solarcharger."):
 			self.track(conn, name, "/Connected", "mppt_connected")
-			self.track(conn, name, "/Dc/0/Voltage", "battery_voltage")
-			self.track(conn, name, "/Dc/0/Current", "battery_current")
+			self.track(conn, name, "/Dc/0/Voltage", "battery_voltage", demand=True)
+			self.track(conn, name, "/Dc/0/Current", "battery_current", demand=True)
 
 	def get_text(self, conn):
 		# Skip page if no mppt connected
@@ -322,6 +468,8 @@ class DetailedBatteryPage(Page):
 			return None
 
 		text = [[_("Battery") + ":", ""], ["", ""]]
+		if self.cache.battery_power is not None:
+			text[0][1] = "{:+.0f} W".format(self.cache.battery_power)
 		if self.cache.battery_voltage is not None:
 			text[1][0] = "{:.1f} V".format(self.cache.battery_voltage)
 		if (self.cache.battery_current is not None):
@@ -346,9 +494,9 @@ class SolarPage(Page):
 	def setup(self, conn, name):
 		if name.startswith("com.victronenergy.solarcharger."):
 			self.track(conn, name, "/Connected", "mppt_connected")
-			self.track(conn, name, "/State", "mppt_state")
-			self.track(conn, name, "/Yield/Power", "pv_power")
-			self.track(conn, name, "/Pv/V", "pv_voltage")
+			self.track(conn, name, "/State", "mppt_state", demand=True)
+			self.track(conn, name, "/Yield/Power", "pv_power", demand=True)
+			self.track(conn, name, "/Pv/V", "pv_voltage", demand=True)
 
 
 	def get_text(self, conn):
@@ -371,6 +519,26 @@ class SolarPage(Page):
 
 		return text
 
+class SolarBarPage(SolarPage):
+	# Bar graph variant, showing PV power relative to the highest power
+	# seen since startup
+	BAR_WIDTH = 9
+	name = "SolarPage"
+
+	def __init__(self):
+		super(SolarBarPage, self).__init__()
+		self.peak = 0
+
+	def get_text(self, conn):
+		text = super(SolarBarPage, self).get_text(conn)
+		if text is None or self.cache.pv_power is None:
+			return text
+
+		self.peak = max(self.peak, self.cache.pv_power)
+		text[1][0] = bar(self.cache.pv_power / self.peak if self.peak else 0, self.BAR_WIDTH)
+		text[1][1] = "{:.0f} W".format(self.cache.pv_power)
+		return text
+
 class SolarHistoryPage(Page):
 	_auto = False
 
@@ -383,6 +551,10 @@ class SolarHistoryPage(Page):
 		self.cache._yield = None
 		self.day = day
 
+	@property
+	def name(self):
+		return "{}{}".format(self.__class__.__name__, self.day)
+
 	def setup(self, conn, name):
 		if name.startswith("com.victronenergy.solarcharger."):
 			self.track(conn, name, "/History/Daily/{}/Yield".format(self.day), "_yield")
@@ -396,6 +568,97 @@ class SolarHistoryPage(Page):
 
 		return text
 
+class BatteryHistoryPage(Page):
+	_auto = False
+
+	def __init__(self):
+		super(BatteryHistoryPage, self).__init__()
+		self.voltage = Series()
+
+	def setup(self, conn, name):
+		if name == "com.victronenergy.system":
+			self.track(conn, name, "/Dc/Battery/Voltage", "battery_voltage",
+				self.voltage.add)
+
+	def get_text(self, conn):
+		if self.voltage.today_min is None:
+			return None
+
+		return [[_("Bat min/max"), _("Today")],
+			["{:.1f} V".format(self.voltage.today_min),
+				"{:.1f} V".format(self.voltage.today_max)]]
+
+class SolarPeakPage(Page):
+	_auto = False
+	WINDOW = 3600
+
+	def __init__(self):
+		super(SolarPeakPage, self).__init__()
+		self.power = Series()
+
+	def setup(self, conn, name):
+		if name.startswith("com.victronenergy.solarcharger."):
+			self.track(conn, name, "/Yield/Power", "pv_power", self.power.add)
+
+	def get_text(self, conn):
+		stats = self.power.window(self.WINDOW)
+		if stats is None:
+			return None
+
+		return [[_("PV peak"), "1h"], ["{:.0f} W".format(stats[1]), ""]]
+
+class EnergyPage(Page):
+	""" Energy used and taken from the grid today, integrated from the
+	    inverter power by energy.EnergyStore. """
+	_auto = False
+
+	def __init__(self, store):
+		super(EnergyPage, self).__init__()
+		self.store = store
+
+	def setup(self, conn, name):
+		if name.startswith("com.victronenergy.vebus."):
+			self.track(conn, name, "/Ac/Out/P", ("ac_out", name),
+				self.store.integrator("consumption:" + name).add)
+			self.track(conn, name, "/Ac/ActiveIn/P", ("ac_in", name),
+				self.store.integrator("grid:" + name).add)
+
+	def cleanup(self, name):
+		# The service is gone, its last power no longer holds
+		if name.startswith("com.victronenergy.vebus."):
+			self.store.integrator("consumption:" + name).add(None)
+			self.store.integrator("grid:" + name).add(None)
+		super(EnergyPage, self).cleanup(name)
+
+	def get_text(self, conn):
+		return [[_("Used"), "{:.1f}kWh".format(
+				self.store.total("consumption:", "today_in"))],
+			[_("Grid in"), "{:.1f}kWh".format(
+				self.store.total("grid:", "today_in"))]]
+
+class BatteryEnergyPage(Page):
+	_auto = False
+
+	def __init__(self, store):
+		super(BatteryEnergyPage, self).__init__()
+		self.store = store
+
+	def setup(self, conn, name):
+		if name == "com.victronenergy.system":
+			self.track(conn, name, "/Dc/Battery/Power", "battery_power",
+				self.store.integrator("battery").add)
+
+	def cleanup(self, name):
+		if name == "com.victronenergy.system":
+			self.store.integrator("battery").add(None)
+		super(BatteryEnergyPage, self).cleanup(name)
+
+	def get_text(self, conn):
+		return [[_("Bat in"), "{:.1f}kWh".format(
+				self.store.total("battery", "today_in"))],
+			[_("Bat out"), "{:.1f}kWh".format(
+				self.store.total("battery", "today_out"))]]
+
 class AcPage(Page):
 	sources = ["AC-in", "Grid", "Genset", "Shore"]
 
@@ -410,8 +673,8 @@ class AcPage(Page):
 		if name.startswith("com.victronenergy.vebus."):
 			self.track(conn, name, "/Connected", "vebus_connected")
 			self.track(conn, name, "/Ac/ActiveIn/Connected", "ac_available")
-			self.track(conn, name, "/Ac/ActiveIn/P", "ac_power_in")
-			self.track(conn, name, "/Ac/Out/P", "ac_power_out")
+			self.track(conn, name, "/Ac/ActiveIn/P", "ac_power_in", demand=True)
+			self.track(conn, name, "/Ac/Out/P", "ac_power_out", demand=True)
 
 	def get_ac_source(self, x):
 		try:
@@ -427,7 +690,8 @@ class AcPage(Page):
 		if self.cache.ac_available is not None and self.cache.ac_source is not None:
 			if self.cache.ac_available == 1:
 				text[0][0] = "{}:".format(self.get_ac_source(self.cache.ac_source))
-				text[0][1] = "{:+.0f} W".format(self.cache.ac_power_in)
+				if self.cache.ac_power_in is not None:
+					text[0][1] = "{:+.0f} W".format(self.cache.ac_power_in)
 			else:
 				text[0][0] = _("AC disconnected")
 				text[0][1] = ""
@@ -446,17 +710,22 @@ class AcPhasePage(Page):
 		self.phase = phase
 		self.cache.ac_power = None
 
+	@property
+	def name(self):
+		return "{}{}".format(self.__class__.__name__, self.phase)
+
 	def setup(self, conn, name):
 		if name.startswith("com.victronenergy.vebus."):
-			self.track(conn, name, "/Ac/ActiveIn/L{}/P".format(self.phase), "ac_power")
-			self.track(conn, name, "/Ac/ActiveIn/L{}/V".format(self.phase), "ac_voltage_out")
+			self.track(conn, name, "/Ac/ActiveIn/L{}/P".format(self.phase), "ac_power", demand=True)
+			self.track(conn, name, "/Ac/ActiveIn/L{}/V".format(self.phase), "ac_voltage_out", demand=True)
 
 	def get_text(self, conn):
 		if self.cache.ac_power is None:
 			return None
 
-		return [["L{} (".format(self.phase) +_("in") + ")",
-				"{:.0f} V".format(self.cache.ac_voltage_out)], [
+		voltage = self.cache.ac_voltage_out
+		return [["L{} (".format(self.phase) + _("in") + ")",
+				"" if voltage is None else "{:.0f} V".format(voltage)], [
 				_("Power") + ":", "{:+.0f} W".format(self.cache.ac_power)]]
 
 class AcOutPhasePage(AcPhasePage):
@@ -466,21 +735,23 @@ class AcOutPhasePage(AcPhasePage):
 
 	def setup(self, conn, name):
 		if name.startswith("com.victronenergy.vebus."):
-			self.track(conn, name, "/Ac/Out/L{}/P".format(self.phase), "ac_power")
-			self.track(conn, name, "/Ac/Out/L{}/V".format(self.phase), "ac_voltage_out")
+			self.track(conn, name, "/Ac/Out/L{}/P".format(self.phase), "ac_power", demand=True)
+			self.track(conn, name, "/Ac/Out/L{}/V".format(self.phase), "ac_voltage_out", demand=True)
 
 	def get_text(self, conn):
 		if self.cache.ac_power is None:
 			return None
 
+		voltage = self.cache.ac_voltage_out
 		return [["L{} (".format(self.phase) + _("out") + ")",
-				"{:.0f} V".format(self.cache.ac_voltage_out)], [
+				"" if voltage is None else "{:.0f} V".format(voltage)], [
 				_("Power") + ":", "{:+.0f} W".format(self.cache.ac_power)]]
 
 class LanPage(Page):
 	def __init__(self):
 		super(LanPage, self).__init__()
 		self._auto = False
+		self._last_text = None
 
 	def _get_text(self, conn, head, iface):
 		text = [[head, ""], ["", ""]]
@@ -488,6 +759,9 @@ class LanPage(Page):
 
 		try:
 			ip_params = get_ipparams(conn, iface)
+		except dbuscall.CircuitOpenError:
+			# connman is not responding, show what we had before
+			return self._last_text or [[head, "n/a"], ["", ""]]
 		except:
 			return None
 
@@ -500,6 +774,7 @@ class LanPage(Page):
 		else:
 			return None
 
+		self._last_text = text
 		return text
 
 	def get_text(self, conn):
@@ -1,30 +1,34 @@
+import logging
 from datetime import datetime, timedelta
 from track import Tracker
+import dbuscall
+import dbus
 
 
 class PAYGService(object):
     SERVICE_NAME = 'com.victronenergy.paygo'
+    WRITE_TIMEOUT_MS = 2000
 
     def __init__(self, conn):
         self.conn = conn
         self.tracker = Tracker()
 
     def service_available(self):
-        payg_enabled = self.tracker.query(self.conn, self.SERVICE_NAME, "/Status/PaygoEnabled")
+        payg_enabled = self._query("/Status/PaygoEnabled")
         if payg_enabled is None:
             return False
         else:
             return True
 
     def is_active(self):
-        is_active = self.tracker.query(self.conn, self.SERVICE_NAME, "/Status/CurrentlyActive")
+        is_active = self._query("/Status/CurrentlyActive")
         if is_active:
             return True
         else:
             return False
 
     def is_payg_enabled(self):
-        payg_enabled = self.tracker.query(self.conn, self.SERVICE_NAME, "/Status/PaygoEnabled")
+        payg_enabled = self._query("/Status/PaygoEnabled")
         if payg_enabled is not None:
             return payg_enabled
         else:
@@ -58,8 +62,9 @@ class PAYGService(object):
         return days_left, hours_left
 
     def update_device_status_if_code_valid(self, token):
-        self._dbus_write(self.SERVICE_NAME, "/Tokens/SetToken", token)
-        token_valid = self.tracker.query(self.conn, self.SERVICE_NAME, "/Tokens/LastTokenValid")
+        if self._dbus_write(self.SERVICE_NAME, "/Tokens/SetToken", token) is None:
+            return None
+        token_valid = self._query("/Tokens/LastTokenValid")
         return token_valid
 
     def update_lvd_value(self, new_lvd_volts):
@@ -67,25 +72,47 @@ class PAYGService(object):
         return True
 
     def get_lvd_value(self):
-        lvd_value = self.tracker.query(self.conn, self.SERVICE_NAME, "/LVD/Threshold")
+        lvd_value = self._query("/LVD/Threshold")
         if lvd_value is not None:
             return lvd_value
         return None
 
     def _get_expiration_date(self):
-        expiration_date = self.tracker.query(self.conn, self.SERVICE_NAME, "/Status/ActiveUntilDate")
+        expiration_date = self._query("/Status/ActiveUntilDate")
         if expiration_date is not None:
             return self._datetime_from_unix_timestamp(expiration_date)
         return None
 
     def _get_blocked_until_date(self):
-        blocked_until_date = self.tracker.query(self.conn, self.SERVICE_NAME, "/Tokens/EntryBlockedUntilDate")
+        blocked_until_date = self._query("/Tokens/EntryBlockedUntilDate")
         if blocked_until_date is not None:
             return self._datetime_from_unix_timestamp(blocked_until_date)
         return None
 
+    def _query(self, path):
+        # While paygo is not responding, answer from the last known values.
+        # Only a reply updates them.
+        try:
+            value = self.tracker.unwrap_value(dbuscall.call_blocking(self.conn,
+                self.SERVICE_NAME, path, None, "GetValue",
+                timeout_ms=self.tracker.QUERY_TIMEOUT_MS))
+        except dbuscall.CircuitOpenError:
+            return self.tracker.cache.get(path)
+        except dbus.exceptions.DBusException as e:
+            if e.get_dbus_name() in dbuscall.TIMEOUT_ERRORS:
+                return self.tracker.cache.get(path)
+            # Paygo answered with an error, or is not there at all
+            value = None
+        self.tracker.cache[path] = value
+        return value
+
     def _dbus_write(self, service_name, path, value):
-        return self.conn.call_blocking(service_name, path, None, "SetValue", 's', [str(value)])
+        try:
+            return dbuscall.call_blocking(self.conn, service_name, path, None, "SetValue",
+                's', [str(value)], timeout_ms=self.WRITE_TIMEOUT_MS)
+        except (dbus.exceptions.DBusException, dbuscall.CircuitOpenError):
+            logging.exception("Failed to write {} on {}".format(path, service_name))
+            return None
 
     def _datetime_from_unix_timestamp(self, timestamp):
         return datetime(1970, 1, 1) + timedelta(seconds=timestamp)
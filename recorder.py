@@ -0,0 +1,61 @@
+import struct
+import marshal
+from time import time, monotonic
+from gi.repository import GLib
+from cache import plain_value
+
+# Record kinds
+HEADER = 'H' # wall clock time the recording started
+SEED = 'S' # value returned by GetValue when a service was set up
+VALUE = 'V' # value from PropertiesChanged or ItemsChanged
+OWNER = 'O' # NameOwnerChanged, path and value hold old and new owner
+
+_length = struct.Struct('<H')
+
+class Recorder(object):
+	""" Appends every value the trackers see to a file, so that it can be
+	    replayed without a bus. Each record is a 16-bit length followed by a
+	    marshalled (time, kind, service, path, value) tuple, time being
+	    seconds since the start of the recording. Values are only recorded
+	    when they change, as several pages receive the same signal. """
+	FLUSH_INTERVAL = 5
+
+	def __init__(self, filename):
+		self.f = open(filename, 'ab')
+		self.start = monotonic()
+		self.last = {}
+		self._write(HEADER, None, None, time())
+		GLib.timeout_add_seconds(self.FLUSH_INTERVAL, self.flush)
+
+	def _write(self, kind, service, path, value):
+		data = marshal.dumps((monotonic() - self.start, kind, service, path, value))
+		self.f.write(_length.pack(len(data)) + data)
+
+	def value(self, service, path, value, seed=False):
+		value = plain_value(value)
+		key = (service, path)
+		if key in self.last and self.last[key] == value:
+			return
+		self.last[key] = value
+		self._write(SEED if seed else VALUE, service, path, value)
+
+	def name_owner_changed(self, name, old, new):
+		self._write(OWNER, name, old, new)
+
+	def flush(self):
+		self.f.flush()
+		return True
+
+def read_records(filename):
+	""" Generates the (time, kind, service, path, value) records in a
+	    recording. A truncated last record is ignored. """
+	with open(filename, 'rb') as f:
+		while True:
+			head = f.read(_length.size)
+			if len(head) < _length.size:
+				return
+			data = f.read(_length.unpack(head)[0])
+			try:
+				yield marshal.loads(data)
+			except (EOFError, ValueError):
+				return
@@ -0,0 +1,56 @@
+import gettext
+from os.path import dirname, abspath
+from os.path import join as pathjoin
+from time import perf_counter
+from cache import smart_dict
+
+# Headless rendering of pages against value snapshots, without a bus or a
+# display. A snapshot is a mapping of cache keys to values, as a page
+# would have them in self.cache, for example {"battery_soc": 55.0}. Keys
+# the page has that are not in the snapshot are None, as when the value is
+# not available, and derived values are computed from the snapshot.
+
+def install_language(language=None):
+	# Pages translate their strings when created, so call this first
+	gettext.translation("messages", pathjoin(dirname(abspath(__file__)), "lang"),
+		languages=[language] if language else None, fallback=True).install()
+
+def snapshot_cache(keys, snapshot):
+	cache = smart_dict.fromkeys(keys)
+	cache.update(snapshot)
+	return cache
+
+def render(page, snapshot):
+	""" Returns the two display lines `page` shows for `snapshot`, or None
+	    if the page would be skipped. Exceptions are not caught, so bad
+	    values show up as errors rather than as a missing page. """
+	cache = page.cache
+	page.cache = snapshot_cache(cache, snapshot)
+	try:
+		page.recompute_all()
+		return page.render()
+	finally:
+		page.cache = cache
+
+def render_batch(page, snapshots):
+	# Generates a frame for every snapshot
+	cache = page.cache
+	try:
+		for snapshot in snapshots:
+			page.cache = snapshot_cache(cache, snapshot)
+			page.recompute_all()
+			yield page.render()
+	finally:
+		page.cache = cache
+
+def renders_per_second(page, snapshots, repeat=3):
+	""" Best of `repeat` runs over `snapshots`. """
+	snapshots = list(snapshots)
+	best = None
+	for _ in range(repeat):
+		start = perf_counter()
+		for frame in render_batch(page, snapshots):
+			pass
+		elapsed = perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return len(snapshots) / best if best else float('inf')
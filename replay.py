@@ -0,0 +1,132 @@
+#!/usr/bin/python3 -u
+
+import sys
+from time import sleep, monotonic
+from argparse import ArgumentParser
+import dbuscall
+from recorder import read_records, SEED, VALUE, OWNER
+from topology import PageManager, ScreenList
+
+class ReplayBus(object):
+	""" Stands in for the bus connection. GetValue is answered from the
+	    recorded values and signals are delivered to the receivers the
+	    pages registered. """
+	def __init__(self):
+		self.values = {}
+		self.receivers = []
+
+	def call_blocking(self, service, path, interface, method, signature, args, timeout=None):
+		if method == "GetValue" and (service, path) in self.values:
+			return self.values[(service, path)]
+		raise LookupError("{} {} not available in replay".format(service, path))
+
+	def add_signal_receiver(self, handler, dbus_interface=None, signal_name=None, path=None, bus_name=None):
+		receiver = _Receiver(self, handler, signal_name, path, bus_name)
+		self.receivers.append(receiver)
+		return receiver
+
+	def properties_changed(self, service, path, value):
+		for r in list(self.receivers):
+			if r.signal_name == 'PropertiesChanged' and r.path == path and r.bus_name == service:
+				r.handler(value)
+
+class _Receiver(object):
+	def __init__(self, bus, handler, signal_name, path, bus_name):
+		self.bus = bus
+		self.handler = handler
+		self.signal_name = signal_name
+		self.path = path
+		self.bus_name = bus_name
+
+	def remove(self):
+		self.bus.receivers.remove(self)
+
+def frames(screens, conn):
+	# Render every page, None for pages that have nothing to show
+	from glyphs import fallback
+	for screen in screens:
+		try:
+			lines = screen.render(conn)
+		except Exception as e:
+			yield screen.name, "exception: {}".format(e)
+			continue
+		if lines is None:
+			yield screen.name, None
+		else:
+			yield screen.name, "|".join(fallback(line) for line in lines)
+
+def replay(filename, pages, realtime=False, out=sys.stdout):
+	""" Feeds a recording into the pages, given as specs for
+	    topology.PageManager, and writes a line to `out` for every page whose
+	    frame changed, at most once per second of recorded time. """
+	conn = ReplayBus()
+	screens = ScreenList()
+	manager = PageManager(conn, pages, screens)
+
+	# Render with all values subscribed, as if every page was on screen
+	def activate():
+		for screen in screens:
+			screen.activate()
+	manager.on_change.append(activate)
+	activate()
+	shown = {}
+	started = monotonic()
+	second = 0
+	records = read_records(filename)
+
+	def render(t):
+		for name, frame in frames(screens, conn):
+			if shown.get(name) != frame:
+				shown[name] = frame
+				out.write("{:10.3f} {:<20} {}\n".format(t, name, frame if frame is not None else "-"))
+
+	pending = None
+	while True:
+		record = pending if pending is not None else next(records, None)
+		pending = None
+		if record is None:
+			break
+		t, kind, service, path, value = record
+
+		if int(t) > second:
+			render(second + 1)
+			second = int(t)
+		if realtime:
+			delay = t - (monotonic() - started)
+			if delay > 0:
+				sleep(delay)
+
+		if kind == SEED:
+			conn.values[(service, path)] = value
+		elif kind == VALUE:
+			conn.values[(service, path)] = value
+			conn.properties_changed(service, path, value)
+		elif kind == OWNER:
+			if path:
+				dbuscall.forget(service)
+				manager.service_removed(service)
+			if value:
+				# Seeds were recorded while the pages were set up, so load
+				# them before doing it again.
+				for record in records:
+					if record[1] != SEED:
+						pending = record
+						break
+					conn.values[(record[2], record[3])] = record[4]
+				manager.service_added(service)
+	render(second + 1)
+
+def main():
+	parser = ArgumentParser(description="Replay a recording made with dbus_characterdisplay.py --record")
+	parser.add_argument('recording')
+	parser.add_argument('--realtime',
+			help='Replay at the recorded speed instead of as fast as possible',
+			default=False, action="store_true")
+	args = parser.parse_args()
+
+	# Importing sets up translations and the list of pages
+	from dbus_characterdisplay import _pages
+	replay(args.recording, _pages, args.realtime)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,165 @@
+#!/usr/bin/python3 -u
+
+# Fixed layout memory mapped file holding the latest values, so that other
+# local tools can read them without going over D-Bus. This module has no
+# dependencies beyond the standard library, so readers can use it as is.
+#
+# Layout, little endian:
+#   header  magic "CDV1", u32 sequence, u32 number of slots, u32 slot size
+#   slots   key (48 bytes, utf-8, zero padded), u8 type, 7 bytes padding,
+#           i64 integer value, f64 float value, string value (32 bytes)
+#
+# The sequence is a seqlock: it is odd while the writer is updating a slot.
+# A reader that sees an odd value, or a different value after reading,
+# has to read again. A writer that starts creates a new file and renames it
+# over the old one, readers notice by the inode and map the new file.
+
+import sys
+import mmap
+import os
+import struct
+from time import perf_counter
+
+MAGIC = b"CDV1"
+HEADER = struct.Struct("<4sIII")
+SLOT = struct.Struct("<48sB7xqd32s")
+SEQUENCE_OFFSET = 4
+
+TYPE_NONE = 0
+TYPE_INT = 1
+TYPE_FLOAT = 2
+TYPE_STR = 3
+
+class Writer(object):
+	def __init__(self, filename, keys):
+		self.keys = keys
+		size = HEADER.size + SLOT.size * len(keys)
+		# Build the file next to the target and rename it into place, so a
+		# reader never maps a half initialised file.
+		tmp = filename + ".tmp"
+		fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+		try:
+			os.ftruncate(fd, size)
+			self.mm = mmap.mmap(fd, size)
+		finally:
+			os.close(fd)
+		self.sequence = 0
+		HEADER.pack_into(self.mm, 0, MAGIC, 0, len(keys), SLOT.size)
+		for i, key in enumerate(keys):
+			SLOT.pack_into(self.mm, HEADER.size + i * SLOT.size,
+				key.encode("utf-8"), TYPE_NONE, 0, 0.0, b"")
+		os.rename(tmp, filename)
+
+	def set(self, index, value):
+		if value is None:
+			t, i, f, s = TYPE_NONE, 0, 0.0, b""
+		elif isinstance(value, float):
+			t, i, f, s = TYPE_FLOAT, 0, value, b""
+		elif isinstance(value, int):
+			t, i, f, s = TYPE_INT, value, 0.0, b""
+		else:
+			t, i, f, s = TYPE_STR, 0, 0.0, str(value).encode("utf-8")[:32]
+
+		self.sequence += 1
+		struct.pack_into("<I", self.mm, SEQUENCE_OFFSET, self.sequence & 0xFFFFFFFF)
+		SLOT.pack_into(self.mm, HEADER.size + index * SLOT.size,
+			self.keys[index].encode("utf-8"), t, i, f, s)
+		self.sequence += 1
+		struct.pack_into("<I", self.mm, SEQUENCE_OFFSET, self.sequence & 0xFFFFFFFF)
+
+def _decode(slot):
+	key, t, i, f, s = slot
+	if t == TYPE_INT:
+		value = i
+	elif t == TYPE_FLOAT:
+		value = f
+	elif t == TYPE_STR:
+		value = s.rstrip(b"\0").decode("utf-8", "replace")
+	else:
+		value = None
+	return key.rstrip(b"\0").decode("utf-8"), value
+
+class Reader(object):
+	""" Reads values from the file written by dbus_characterdisplay.py
+	    --export. Values are decoded straight from the mapping. A restarted
+	    writer puts a new file in place, which is picked up on the next
+	    read. """
+	# Reads while the writer is busy before giving up, a writer that died
+	# halfway an update leaves the sequence odd
+	RETRIES = 10000
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.mm = None
+		self.open()
+
+	def open(self):
+		with open(self.filename, "rb") as f:
+			mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			self.inode = os.fstat(f.fileno()).st_ino
+		magic, _, count, slot_size = HEADER.unpack_from(mm, 0)
+		if magic != MAGIC or slot_size != SLOT.size:
+			mm.close()
+			raise ValueError("{} is not a value export".format(self.filename))
+		if self.mm is not None:
+			self.mm.close()
+		self.mm = mm
+		self.count = count
+		self.index = {}
+		for i in range(count):
+			key, _ = _decode(SLOT.unpack_from(self.mm, HEADER.size + i * SLOT.size))
+			self.index[key] = i
+
+	def _sequence(self):
+		return struct.unpack_from("<I", self.mm, SEQUENCE_OFFSET)[0]
+
+	def _read(self, read):
+		if os.stat(self.filename).st_ino != self.inode:
+			self.open()
+		for _ in range(self.RETRIES):
+			before = self._sequence()
+			if before & 1:
+				continue
+			value = read()
+			if self._sequence() == before:
+				return value
+		raise TimeoutError("{} is not updated consistently".format(self.filename))
+
+	def get(self, key):
+		# The key is looked up after a reopen, the slots may have moved
+		return self._read(lambda: _decode(SLOT.unpack_from(self.mm,
+			HEADER.size + self.index[key] * SLOT.size))[1])
+
+	def snapshot(self):
+		# All values as a dict, consistent with each other
+		return self._read(lambda: dict(_decode(SLOT.unpack_from(self.mm,
+			HEADER.size + i * SLOT.size)) for i in range(self.count)))
+
+	def close(self):
+		self.mm.close()
+
+def benchmark(filename, rounds=10000):
+	# Returns microseconds per read of a single value and of a snapshot
+	reader = Reader(filename)
+	key = next(iter(reader.index))
+	start = perf_counter()
+	for _ in range(rounds):
+		reader.get(key)
+	single = (perf_counter() - start) / rounds * 1e6
+	start = perf_counter()
+	for _ in range(rounds):
+		reader.snapshot()
+	snapshot = (perf_counter() - start) / rounds * 1e6
+	reader.close()
+	return single, snapshot
+
+def main():
+	if len(sys.argv) != 2:
+		print("Usage: {} <export file>".format(sys.argv[0]))
+		return 1
+	for key, value in sorted(Reader(sys.argv[1]).snapshot().items()):
+		print("{:<24} {}".format(key, value))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
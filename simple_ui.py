@@ -1,5 +1,8 @@
+import logging
 from evdev import ecodes
 from time import time
+from gi.repository import GLib
+from tracering import ring, KEY
 
 
 class cycle(object):
@@ -23,17 +26,21 @@ class SimpleUserInterface(object):
 
     ROLL_TIMEOUT = 5
     ACTIVITY_TIMEOUT = 300
+    PREPARE_BATCH = 4
 
-    def __init__(self, lcd, conn, kbd, static_screens):
+    def __init__(self, lcd, conn, kbd, static_screens, alarms):
         self.lcd = lcd
         self.conn = conn
         self.kbd = kbd
+        self.alarms = alarms
         self._screens = static_screens
         self.screen_cycle = cycle(self._screens)
         self.screen = None
         self.count = self.ROLL_TIMEOUT
         self._idle = False
         self._last_activity = time()
+        self._active = []
+        self._prepared = None
 
     @property
     def idle(self):
@@ -50,13 +57,17 @@ class SimpleUserInterface(object):
         return max(0, time() - self._last_activity)
 
     def start(self):
-        pass
+        self.alarms.update()
+        # With values restored from a snapshot there is no need to wait
+        if any(screen.stale for screen in self._screens):
+            self.screen = self._roll_screens(True)
 
     def key_pressed(self):
         for event in self.kbd.read():
             # We could check for event.code == ecodes.KEY_LEFT but there
             # is only one button, so lets just make them all do the same.
             if event.type == ecodes.EV_KEY and event.value == 1:
+                ring.add(KEY, event.code)
                 backlight = self.lcd.daylight
                 if backlight and not self.lcd.on:
                     # Backlight is off but should be on. Then also restart
@@ -70,12 +81,19 @@ class SimpleUserInterface(object):
 
                 self.idle = False
                 self.lcd.on = backlight
-                self.screen = self._roll_screens(False)
+                # A press while an alarm is shown only hides the alarm
+                if not self.alarms.dismiss():
+                    self._prepared = None
+                    self.screen = self._roll_screens(False)
 
     def tick(self):
         backlight = True
-        if self.count == 0:
-            self.screen = self._roll_screens(True)
+        self.alarms.tick()
+        if self.alarms.showing:
+            # Alarms are on the display, hold the slideshow
+            self.count = self.ROLL_TIMEOUT
+        elif self.count == 0:
+            self.screen = self._roll_prepared()
             if self.idle_time > self.ACTIVITY_TIMEOUT:
                 self.idle = True
                 backlight = False
@@ -83,20 +101,100 @@ class SimpleUserInterface(object):
             # Update the screen text
             self.screen.display(self.conn, self.lcd)
         self.count = self.count - 1 if self.count > 0 else self.ROLL_TIMEOUT
+        if self.count == 0 and self.screen is not None:
+            # The next tick rolls, get the screen ready in the meantime
+            self._schedule_prepare()
 
         # Manage the backlight. Short Circuit eval means daylight sensor
         # is only consulted if the backlight would be on
         if self.lcd.on:
             self.lcd.on = backlight and self.lcd.daylight
 
+        # Nobody is looking, drop the subscriptions only needed for display
+        if not self.lcd.on:
+            self._set_active([])
+
+    def _set_active(self, screens):
+        # Pages subscribe to display-only values while they are active
+        for screen in self._active:
+            if screen not in screens:
+                screen.deactivate(self)
+        if self.lcd.on:
+            for screen in screens:
+                screen.activate(self)
+            self._active = list(screens)
+        else:
+            self._active = []
+
+    def _in_slideshow(self, screen):
+        # Alarm pages are left out while the alarm overlay shows them
+        return screen.auto and not self.alarms.owns(screen)
+
     def _show_screen(self, screen):
         return screen.display(self.conn, self.lcd)
 
+    def _frame(self, screen):
+        try:
+            return screen.frame(self.conn)
+        except Exception:
+            logging.exception("Exception preparing page")
+            return None
+
+    def _schedule_prepare(self):
+        self._prepared = None
+        try:
+            i = self._screens.index(self.screen)
+        except ValueError:
+            return
+        candidates = iter(self._screens[i + 1:] + self._screens[:i + 1])
+        GLib.idle_add(self._prepare, self.screen, candidates)
+
+    def _prepare(self, screen, candidates):
+        """ Finds and renders the screen the next roll will show, so that
+            the roll only has to write it. Only PREPARE_BATCH candidates
+            are looked at per call, other events are handled in between. """
+        if screen is not self.screen:
+            # A key press moved the slideshow on
+            return False
+        for n, candidate in enumerate(candidates, 1):
+            # Whether a page is skipped follows from the values that are
+            # always subscribed, only the one that is shown gets activated
+            if self._in_slideshow(candidate) and self._frame(candidate) is not None:
+                self._set_active([screen, candidate])
+                lines = self._frame(candidate)
+                if lines is not None:
+                    self._prepared = (candidate, lines)
+                return False
+            if n == self.PREPARE_BATCH:
+                return True
+        return False
+
+    def _roll_prepared(self):
+        prepared, self._prepared = self._prepared, None
+        if prepared is None or prepared[0] not in self._screens:
+            return self._roll_screens(True)
+
+        screen, lines = prepared
+        self.lcd.page = screen.name
+        self.lcd.display_frame(lines)
+        # Line the slideshow up with the screen now shown
+        self.screen_cycle.reset()
+        for s in self.screen_cycle:
+            if s is screen:
+                break
+        self._set_active([screen])
+        return screen
+
     def _roll_screens(self, auto):
         # Cheap way of avoiding infinite loop
         for screen, _ in zip(self.screen_cycle, self._screens):
-            if auto and not screen.auto:
+            if auto and not self._in_slideshow(screen):
+                continue
+            # Pages that are skipped are not activated, activating is
+            # what fetches their display-only values
+            if self._frame(screen) is None:
                 continue
+            self._set_active([screen])
             if self._show_screen(screen):
                 return screen
         return None
@@ -0,0 +1,62 @@
+import os
+import marshal
+import logging
+from gi.repository import GLib
+from cache import plain_value, plain_key
+
+SNAPSHOT_VERSION = 1
+
+def plain_cache(cache):
+	# Only builtin types can be marshalled, not the D-Bus subclasses
+	return dict((plain_key(k), plain_value(v)) for k, v in cache.items())
+
+def valid(data):
+	return isinstance(data, dict) and data.get("version") == SNAPSHOT_VERSION and \
+		isinstance(data.get("services"), list) and \
+		all(isinstance(name, str) for name in data["services"]) and \
+		isinstance(data.get("phases"), dict) and \
+		isinstance(data.get("pages"), dict) and \
+		all(isinstance(values, dict) for values in data["pages"].values())
+
+def save(filename, manager):
+	""" Writes the services that are up, the number of phases and the cache
+	    of every page. The file is replaced with a rename, so a crash halfway
+	    leaves the previous snapshot in place. """
+	data = {
+		"version": SNAPSHOT_VERSION,
+		"services": sorted(str(name) for name in manager.services),
+		"phases": plain_cache(manager.cache),
+		"pages": dict((str(page.name), plain_cache(page.cache)) for page in manager.screens),
+	}
+	tmp = filename + ".tmp"
+	with open(tmp, "wb") as f:
+		marshal.dump(data, f)
+	os.rename(tmp, filename)
+
+def load(filename):
+	try:
+		with open(filename, "rb") as f:
+			data = marshal.load(f)
+	except (OSError, EOFError, ValueError, TypeError):
+		return None
+	# A file of another version or a damaged one is as good as none
+	if not valid(data):
+		return None
+	return data
+
+class SnapshotWriter(object):
+	""" Saves a snapshot every INTERVAL seconds. """
+	INTERVAL = 30
+
+	def __init__(self, filename, manager):
+		self.filename = filename
+		self.manager = manager
+		GLib.timeout_add_seconds(self.INTERVAL, self.save)
+
+	def save(self):
+		try:
+			save(self.filename, self.manager)
+		except (OSError, ValueError):
+			# Tried again at the next interval
+			logging.exception("Failed to save snapshot to {}".format(self.filename))
+		return True
@@ -0,0 +1,145 @@
+#!/usr/bin/python3 -u
+
+# Soak test for service churn: services come and go thousands of times
+# against the real pages, the way a vebus or solarcharger does when it keeps
+# restarting. Receivers, watches, cache entries, objects and traced memory
+# are sampled as it runs and the test fails if any of them keep growing.
+
+import sys
+import gc
+import tracemalloc
+from argparse import ArgumentParser
+import dbus
+
+from benchmark import FakeBus, SERVICES
+from topology import PageManager, ScreenList
+from dbus_characterdisplay import _pages
+
+# Services that restart, the others stay up
+CHURN = ("com.victronenergy.vebus.ttyO1", "com.victronenergy.solarcharger.ttyO2")
+
+class CountingBus(FakeBus):
+	""" FakeBus that keeps track of the receivers that were not removed. """
+	def __init__(self):
+		self.receivers = set()
+
+	def add_signal_receiver(self, handler, **kwargs):
+		receiver = _CountedReceiver(self.receivers)
+		self.receivers.add(receiver)
+		return receiver
+
+	def match_rules(self):
+		return len(self.receivers)
+
+class _CountedReceiver(object):
+	def __init__(self, receivers):
+		self.receivers = receivers
+
+	def remove(self):
+		self.receivers.discard(self)
+
+class SystemBus(object):
+	""" The real system bus, with services that do not exist, so that the
+	    match rules the daemon holds for us can be counted. This needs a
+	    dbus-daemon with the Debug.Stats interface. """
+	def __init__(self):
+		self.conn = dbus.SystemBus()
+		self.receivers = None
+
+	def __getattr__(self, name):
+		return getattr(self.conn, name)
+
+	def match_rules(self):
+		stats = self.conn.call_blocking("org.freedesktop.DBus", "/org/freedesktop/DBus",
+			"org.freedesktop.DBus.Debug.Stats", "GetConnectionStats", "s",
+			(self.conn.get_unique_name(),))
+		return int(stats["MatchRules"])
+
+def sample(bus, screens, manager):
+	pages = list(screens) + [manager]
+	return {
+		"receivers": None if bus.receivers is None else len(bus.receivers),
+		"match_rules": bus.match_rules(),
+		"watches": sum(len(w) for p in pages for w in p.watches.values()) +
+			sum(len(w) for p in pages for w in p.demand_watches.values()),
+		"watch_keys": sum(len(p.watches) + len(p.demand) + len(p.demand_watches)
+			for p in pages),
+		"cache": sum(len(p.cache) for p in pages),
+		"objects": len(gc.get_objects()),
+		"memory": tracemalloc.get_traced_memory()[0],
+	}
+
+def cycle(manager, screens, i):
+	for name in CHURN:
+		manager.service_removed(name)
+	for name in CHURN:
+		manager.service_added(name)
+	# Pages come and go in the slideshow too, that moves demand subscriptions
+	page = screens[i % len(screens)]
+	page.activate()
+	page.deactivate()
+
+def main():
+	parser = ArgumentParser(description=sys.argv[0])
+	parser.add_argument('--cycles',
+			help='Number of restart cycles, default 5000',
+			type=int, default=5000)
+	parser.add_argument('--samples',
+			help='Number of samples taken over the run, default 20',
+			type=int, default=20)
+	parser.add_argument('--memory-slack',
+			help='Bytes per cycle that traced memory may grow by, default 8',
+			type=float, default=8)
+	parser.add_argument('--object-slack',
+			help='Objects per cycle that the gc may track more of, default 0.05',
+			type=float, default=0.05)
+	parser.add_argument('--system',
+			help='Subscribe on the system bus and count match rules in dbus-daemon',
+			default=False, action="store_true")
+	args = parser.parse_args()
+	if args.cycles < 1 or args.samples < 1:
+		parser.error("--cycles and --samples must be at least 1")
+
+	bus = SystemBus() if args.system else CountingBus()
+	screens = ScreenList()
+	manager = PageManager(bus, _pages, screens)
+	for name in SERVICES:
+		manager.service_added(name)
+
+	# Warm up first, caches and interned strings fill up in the first cycles
+	every = max(args.cycles // args.samples, 1)
+	for i in range(every):
+		cycle(manager, screens, i)
+
+	# Growth is measured over the second half of the run, so that one-off
+	# growth early on does not count. Only two samples are kept, keeping
+	# all of them would show up as growth.
+	half = every * max(args.samples // 2, 1)
+	tracemalloc.start()
+	for i in range(1, args.cycles + 1):
+		cycle(manager, screens, i)
+		if i % every == 0:
+			gc.collect()
+			last, end = i, sample(bus, screens, manager)
+			if i <= half:
+				first, start = i, end
+			print("{:>7} {}".format(i, " ".join("{}={}".format(k, v)
+				for k, v in sorted(end.items()))))
+	tracemalloc.stop()
+
+	failed = False
+	print()
+	for key in sorted(end):
+		if end[key] is None:
+			continue
+		growth = (end[key] - start[key]) / float(max(last - first, 1))
+		allowed = {"memory": args.memory_slack, "objects": args.object_slack}.get(key, 0)
+		bad = growth > allowed
+		failed = failed or bad
+		print("{:<12} {:>12} -> {:>12} {:>+10.3f}/cycle{}".format(key, start[key], end[key],
+			growth, " GROWING" if bad else ""))
+
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
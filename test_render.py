@@ -0,0 +1,230 @@
+import os
+import tempfile
+import unittest
+from functools import partial
+
+import render
+render.install_language("en")
+
+from replay import ReplayBus
+from glyphs import fallback
+from marquee import ScrollingLine
+from energy import EnergyStore
+from pages import BatteryPage, DetailedBatteryPage, ReasonPage, StatusPage, VebusErrorPage
+from pages import AcPage, AcPhasePage, AcOutPhasePage, SolarPage, SolarErrorPage
+from pages import SolarHistoryPage, BatteryBarPage, SolarBarPage, BatteryHistoryPage
+from pages import SolarPeakPage, EnergyPage, BatteryEnergyPage, VebusAlarmsPage
+from pages import LanPage, WlanPage, VEBUS_ALARM_BITS
+from render import render as render_page, render_batch
+from dbus_characterdisplay import _pages
+
+SYSTEM = "com.victronenergy.system"
+SETTINGS = "com.victronenergy.settings"
+VEBUS = "com.victronenergy.vebus.ttyO1"
+SOLAR = "com.victronenergy.solarcharger.ttyO2"
+SERVICES = (SYSTEM, SETTINGS, VEBUS, SOLAR)
+
+def setup_page(page, *services):
+	# Nothing is on the bus, so every value the page tracks starts as None
+	conn = ReplayBus()
+	for name in services:
+		page.setup(conn, name)
+	return page
+
+def frame(lines):
+	# Glyphs as their ascii fallback, so that frames can be compared as text
+	return None if lines is None else [fallback(line) for line in lines]
+
+class ConnmanBus(ReplayBus):
+	def call_blocking(self, service, path, interface, method, signature, args, timeout=None):
+		if method == "GetServices":
+			return [("/net/connman/service/ethernet_0",
+					{"IPv4": {"Method": "dhcp", "Address": "192.168.1.5"}}),
+				("/net/connman/service/wifi_0",
+					{"IPv6": {"Method": "auto", "Address": "fe80::1"}})]
+		return super(ConnmanBus, self).call_blocking(service, path, interface, method,
+			signature, args, timeout)
+
+# Factory, services, snapshot and the frame it shows, None if skipped
+GOLDEN = [
+	(StatusPage, (SYSTEM, SETTINGS), {"state": 0x09, "systemname": "Boat"},
+		["      Boat      ", "     Invert     "]),
+	(StatusPage, (SYSTEM, SETTINGS), {"state": 0x103, "systemtype": "ESS"},
+		["      ESS       ", "  Sched Charge  "]),
+	(StatusPage, (SYSTEM, SETTINGS), {"state": 0x55}, ["     Status     ", "                "]),
+	(StatusPage, (SYSTEM, SETTINGS), {}, ["Wait...         ", "                "]),
+	(ReasonPage, (SYSTEM, SETTINGS), {"bl": 1, "ucl": 1, "udl": 1, "systemtype": "ESS"},
+		["      ESS       ", "     #2,6,7     "]),
+	(ReasonPage, (SYSTEM, SETTINGS), {"bl": 0}, None),
+	(VebusErrorPage, (VEBUS,), {"vebus_error": 2}, ["VE.Bus error: #2", "Contact support "]),
+	(VebusErrorPage, (VEBUS,), {"vebus_error": 99}, ["VE.Bus error:#99", "                "]),
+	(VebusErrorPage, (VEBUS,), {"vebus_error": 0}, None),
+	(VebusErrorPage, (VEBUS,), {}, None),
+	(AcPage, (SYSTEM, VEBUS), {"vebus_connected": 1, "ac_available": 1, "ac_source": 2,
+		"ac_power_in": 1234.0, "ac_power_out": -56.0}, ["Genset:  +1234 W", "Output:    -56 W"]),
+	(AcPage, (SYSTEM, VEBUS), {"vebus_connected": 1, "ac_available": 0, "ac_source": 1,
+		"ac_power_out": 99999999.0}, ["AC disconnected ", "Output:+99999999"]),
+	(AcPage, (SYSTEM, VEBUS), {"vebus_connected": 1}, ["NO AC DATA      ", "                "]),
+	(AcPage, (SYSTEM, VEBUS), {"vebus_connected": 0}, None),
+	(partial(AcPhasePage, 1), (VEBUS,), {"ac_power": 1500.0, "ac_voltage_out": 230.4},
+		["L1 (in)    230 V", "Power:   +1500 W"]),
+	(partial(AcPhasePage, 2), (VEBUS,), {"ac_power": -20.0}, ["L2 (in)         ", "Power:     -20 W"]),
+	(partial(AcPhasePage, 3), (VEBUS,), {}, None),
+	(partial(AcOutPhasePage, 1), (VEBUS,), {"ac_power": 800.0, "ac_voltage_out": 229.6},
+		["L1 (out)   230 V", "Power:    +800 W"]),
+	(partial(AcOutPhasePage, 2), (VEBUS,), {"ac_power": 800.0}, ["L2 (out)        ", "Power:    +800 W"]),
+	(partial(AcOutPhasePage, 3), (VEBUS,), {}, None),
+	(BatteryPage, (SYSTEM,), {"battery_soc": 55.0, "battery_voltage": 12.84, "battery_power": -120.0},
+		["Battery:  55.0 %", "-120 W    12.8 V"]),
+	(BatteryPage, (SYSTEM,), {"battery_soc": 55.0}, ["Battery:  55.0 %", "                "]),
+	(BatteryPage, (SYSTEM,), {}, None),
+	(BatteryBarPage, (SYSTEM,), {"battery_soc": 55.0, "battery_power": -120.0},
+		["Battery:v 55.0 %", "########|       "]),
+	(BatteryBarPage, (SYSTEM,), {"battery_soc": 100.0, "battery_power": 3000.0},
+		["Battery:^100.0 %", "################"]),
+	(BatteryBarPage, (SYSTEM,), {"battery_soc": 0.0}, ["Battery:   0.0 %", "                "]),
+	(DetailedBatteryPage, (SOLAR,), {"mppt_connected": 1, "battery_voltage": 12.5,
+		"battery_current": 4.0}, ["Battery:   +50 W", "12.5 V     4.0 A"]),
+	(DetailedBatteryPage, (SOLAR,), {"mppt_connected": 1, "battery_voltage": 12.5},
+		["Battery:        ", "12.5 V          "]),
+	(DetailedBatteryPage, (SOLAR,), {"mppt_connected": 0}, None),
+	(SolarPage, (SOLAR,), {"mppt_connected": 1, "mppt_state": 3, "pv_power": 345.6,
+		"pv_voltage": 48.21}, ["Solar:      Bulk", "346 W     48.2 V"]),
+	(SolarPage, (SOLAR,), {"mppt_connected": 1, "mppt_state": 99}, ["Solar:   unknown", "                "]),
+	(SolarPage, (SOLAR,), {"mppt_connected": 0}, None),
+	(SolarBarPage, (SOLAR,), {"mppt_connected": 1, "mppt_state": 5, "pv_power": 250.0},
+		["Solar:     Float", "#########  250 W"]),
+	(SolarBarPage, (SOLAR,), {"mppt_connected": 1, "mppt_state": 5, "pv_power": 0.0},
+		["Solar:     Float", "             0 W"]),
+	(SolarErrorPage, (SOLAR,), {"mppt_error": 17}, ["MPPT error:  #17", "Overheat        "]),
+	(SolarErrorPage, (SOLAR,), {"mppt_error": 250}, ["MPPT error: #250", "                "]),
+	(SolarErrorPage, (SOLAR,), {"mppt_error": 0}, None),
+	(partial(SolarHistoryPage, 0), (SOLAR,), {"_yield": 1.234}, ["Yield      Today", "1.23 KWh        "]),
+	(partial(SolarHistoryPage, 1), (SOLAR,), {"_yield": 12345.6}, ["Yield  Yesterday", "12345.60 KWh    "]),
+	(partial(SolarHistoryPage, 1), (SOLAR,), {"_yield": None}, None),
+]
+
+class GoldenFrameTest(unittest.TestCase):
+	def test_golden(self):
+		for factory, services, snapshot, expected in GOLDEN:
+			page = setup_page(factory(), *services)
+			with self.subTest(page=page.name, snapshot=snapshot):
+				self.assertEqual(frame(render_page(page, snapshot)), expected)
+
+	def test_every_page_without_values(self):
+		# A page without values is skipped or shows placeholders, it never
+		# fails
+		for factory, requires, phase in _pages:
+			page = setup_page(factory(), *SERVICES)
+			with self.subTest(page=page.name):
+				lines = render_page(page, {})
+				if lines is not None:
+					self.assertEqual([len(line) for line in lines], [16, 16])
+
+	def test_huge_values_scroll(self):
+		page = setup_page(BatteryPage(), SYSTEM)
+		lines = render_page(page, {"battery_soc": 100.0, "battery_power": -123456789.0,
+			"battery_voltage": 12.84})
+		self.assertEqual(lines, ["Battery: 100.0 %", "-123456789 W12.8"])
+		self.assertIsInstance(lines[1], ScrollingLine)
+		self.assertEqual(lines[1].frame(1), "-123456789 W2.8 ")
+
+	def test_alarms(self):
+		page = setup_page(VebusAlarmsPage(), VEBUS)
+		self.assertIsNone(render_page(page, {}))
+		for bit, (path, alarm, phase) in enumerate(VEBUS_ALARM_BITS):
+			if (alarm, phase) == ("Overload", 2):
+				page.update_alarm(VEBUS, 1 << bit, 2)
+		self.assertEqual(render_page(page, {}), ["Alarm:        L2", "Overload        "])
+
+	def test_history(self):
+		page = setup_page(BatteryHistoryPage(), SYSTEM)
+		self.assertIsNone(render_page(page, {}))
+		for v in (12.6, 13.8, 11.9):
+			page.voltage.add(v)
+		self.assertEqual(render_page(page, {}), ["Bat min/maxToday", "11.9 V    13.8 V"])
+
+		page = setup_page(SolarPeakPage(), SOLAR)
+		self.assertIsNone(render_page(page, {}))
+		for v in (120.0, 1830.4, 0.0):
+			page.power.add(v)
+		self.assertEqual(render_page(page, {}), ["PV peak       1h", "1830 W          "])
+
+	def test_energy(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			store = EnergyStore(os.path.join(tmp, "energy"))
+			store.integrator("consumption:" + VEBUS).today_in = 12.34
+			store.integrator("grid:" + VEBUS).today_in = 0.0
+			store.integrator("battery").today_in = 1.25
+			store.integrator("battery").today_out = 2.5
+			page = setup_page(EnergyPage(store), VEBUS)
+			self.assertEqual(render_page(page, {}), ["Used     12.3kWh", "Grid in   0.0kWh"])
+			page = setup_page(BatteryEnergyPage(store), SYSTEM)
+			self.assertEqual(render_page(page, {}), ["Bat in    1.2kWh", "Bat out   2.5kWh"])
+
+	def test_network(self):
+		conn = ConnmanBus()
+		self.assertEqual(LanPage().render(conn), ["LAN IP:     dhcp", "192.168.1.5     "])
+		self.assertEqual(WlanPage().render(conn), ["WIFI IP:    auto", "fe80::1         "])
+		# Without connman there is nothing to show
+		self.assertIsNone(LanPage().render(ReplayBus()))
+
+	def test_languages(self):
+		# Every translation in lang/ renders the same pages, the text itself
+		# is only checked for the built-in strings
+		lang = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lang")
+		try:
+			languages = [name for name in os.listdir(lang)
+				if os.path.isdir(os.path.join(lang, name, "LC_MESSAGES"))]
+		except OSError:
+			languages = []
+		try:
+			for language in languages:
+				render.install_language(language)
+				for factory, services, snapshot, expected in GOLDEN:
+					page = setup_page(factory(), *services)
+					with self.subTest(language=language, page=page.name):
+						lines = render_page(page, snapshot)
+						self.assertEqual(lines is None, expected is None)
+						if lines is not None:
+							self.assertEqual([len(line) for line in lines], [16, 16])
+		finally:
+			render.install_language("en")
+
+	def test_missing_values(self):
+		# Keys the page tracks but the snapshot does not have are None
+		page = setup_page(BatteryPage(), SYSTEM)
+		self.assertEqual(render_page(page, {"battery_soc": 55.0}),
+			["Battery:  55.0 %", "                "])
+
+	def test_derived(self):
+		page = setup_page(DetailedBatteryPage(), SOLAR)
+		self.assertEqual(render_page(page, {"mppt_connected": 1,
+			"battery_voltage": 12.5, "battery_current": 4.0}),
+			["Battery:   +50 W", "12.5 V     4.0 A"])
+		page = setup_page(ReasonPage(), SYSTEM, SETTINGS)
+		self.assertEqual(render_page(page, {"bl": 1, "ls": 1, "systemname": "Boat"}),
+			["      Boat      ", "      #1,2      "])
+		self.assertIsNone(render_page(page, {"bl": 0}))
+
+	def test_stale(self):
+		# The marker takes the last cell, the fields make room for it
+		page = setup_page(VebusErrorPage(), VEBUS)
+		page.restore({"vebus_error": 2})
+		self.assertEqual(render_page(page, {"vebus_error": 2}),
+			["VE.Bus error:#2*", "Contact support "])
+
+	def test_batch(self):
+		page = setup_page(BatteryPage(), SYSTEM)
+		frames = list(render_batch(page, [{"battery_soc": 100.0}, {}]))
+		self.assertEqual(frames, [["Battery: 100.0 %", "                "], None])
+
+	def test_cache_restored(self):
+		page = setup_page(BatteryPage(), SYSTEM)
+		cache = page.cache
+		render_page(page, {"battery_soc": 1.0})
+		self.assertIs(page.cache, cache)
+		self.assertIsNone(page.cache.battery_soc)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,170 @@
+from time import monotonic
+from gi.repository import GLib
+from track import Tracker
+import dbuscall
+
+def service_type(name):
+	# com.victronenergy.solarcharger.ttyO1 -> solarcharger
+	parts = name.split('.')
+	return parts[2] if len(parts) > 2 else None
+
+class ScreenList(list):
+	""" The pages that currently exist, in display order. """
+	def find(self, name):
+		for page in self:
+			if page.name == name:
+				return page
+		return None
+
+class PageManager(Tracker):
+	""" Creates pages when a service they need appears and removes them
+	    when the last such service goes away, so that only the pages for
+	    the installed hardware exist. Specs are (factory, service type,
+	    phase) tuples in display order. A service type of None means the
+	    page always exists, a phase means the page only exists if a vebus
+	    device has at least that many phases. """
+	def __init__(self, conn, specs, screens):
+		super(PageManager, self).__init__()
+		self.conn = conn
+		self.specs = specs
+		self.screens = screens
+		self.services = set()
+		self.restored = set() # services from a snapshot, not seen yet
+		self.pages = {} # spec index -> page
+		self.on_change = []
+		self.trackers = [] # set up for every service, but not pages
+		self.update()
+
+	@property
+	def phases(self):
+		return max([self.cache.get(name) or 1 for name in self.services | self.restored
+			if service_type(name) == "vebus"] or [1])
+
+	def restore(self, snapshot):
+		""" Creates the pages for the services in a snapshot and fills them
+		    with the values they had, marked as stale, so that something
+		    can be shown before the services have been queried. """
+		self.restored = set(snapshot["services"]) - self.services
+		self.cache.update(snapshot["phases"])
+		self.update()
+		for page in self.screens:
+			values = snapshot["pages"].get(page.name)
+			if values is not None:
+				page.restore(values)
+
+	def restore_done(self):
+		# Drop pages for restored services that did not come back
+		for name in self.restored:
+			self.cache.pop(name, None)
+		self.restored = set()
+		self.update()
+		# Values of services that are gone will not be confirmed
+		for page in self.screens:
+			page.stale_keys = page.stale_keys & page.tracked()
+
+	def service_added(self, name):
+		existing = list(self.pages.values())
+		self.services.add(name)
+		self.restored.discard(name)
+		for page in existing + self.trackers:
+			page.setup(self.conn, name)
+		if service_type(name) == "vebus":
+			self.track(self.conn, name, "/Ac/NumberOfPhases", name,
+				lambda v: self.update())
+		self.update()
+
+	def service_removed(self, name):
+		self.services.discard(name)
+		for page in list(self.pages.values()) + self.trackers:
+			page.cleanup(name)
+		self.cleanup(name)
+		self.cache.pop(name, None)
+		self.update()
+
+	def update(self):
+		present = set(service_type(name) for name in self.services | self.restored)
+		phases = self.phases
+		changed = False
+		for i, (factory, requires, phase) in enumerate(self.specs):
+			wanted = (requires is None or requires in present) and \
+				(not phase or phase <= phases)
+			if wanted and i not in self.pages:
+				page = self.pages[i] = factory()
+				for name in sorted(self.services):
+					page.setup(self.conn, name)
+				changed = True
+			elif not wanted and i in self.pages:
+				page = self.pages.pop(i)
+				page.owners.clear() # cleanup_all drops the demand subscriptions
+				page.cleanup_all()
+				changed = True
+
+		if changed:
+			self.screens[:] = [self.pages[i] for i in sorted(self.pages)]
+			for callback in self.on_change:
+				callback()
+
+class ServiceEvents(object):
+	""" Collects NameOwnerChanged for the services and passes them on to
+	    the manager in batches, once a name has been quiet for a while.
+	    Names that keep changing have to be quiet for longer each time. A
+	    service that restarts within that time keeps its pages, values and
+	    subscriptions, as the receivers follow the name to the new owner.
+	    Changes are recorded when they are applied, so that a replay sets
+	    up the same services at the same point. """
+	SETTLE_MS = 500
+	MAX_SETTLE_MS = 16000
+	CALM_SECONDS = 60 # after this long without changes the delay is reset
+
+	def __init__(self, manager):
+		self.manager = manager
+		self.pending = {} # name -> (due time, owner before, owner now)
+		self.restarted = set()
+		self.delay = {} # name -> settle time in ms
+		self.last = {} # name -> time of the last change
+		self.timer = None
+
+	def name_owner_changed(self, name, old, new):
+		now = monotonic()
+		delay = self.SETTLE_MS
+		if now - self.last.get(name, -self.CALM_SECONDS) < self.CALM_SECONDS:
+			delay = min(self.delay.get(name, self.SETTLE_MS) * 2, self.MAX_SETTLE_MS)
+		self.delay[name] = delay
+		self.last[name] = now
+		if new and (old or name in self.pending and not self.pending[name][2]):
+			self.restarted.add(name)
+		before = self.pending[name][1] if name in self.pending else old
+		self.pending[name] = (now + delay / 1000.0, before, new)
+		if self.timer is None:
+			self.timer = GLib.timeout_add(self.SETTLE_MS, self.process)
+
+	def record(self, name, old, new):
+		if Tracker.recorder is not None:
+			Tracker.recorder.name_owner_changed(name, old, new)
+
+	def process(self):
+		now = monotonic()
+		due = [name for name, (when, before, owner) in self.pending.items()
+			if when <= now]
+		added = []
+		for name in sorted(due):
+			when, before, owner = self.pending.pop(name)
+			restarted = name in self.restarted
+			self.restarted.discard(name)
+			if restarted or not owner:
+				dbuscall.forget(name)
+			if name in self.manager.services and not owner:
+				# Replay removes on any old owner, setup_pending may have
+				# added the service while this change was settling
+				self.record(name, before or name, '')
+				self.manager.service_removed(name)
+			elif name not in self.manager.services and owner:
+				added.append((name, owner))
+		for name, owner in added:
+			self.record(name, '', owner)
+			self.manager.service_added(name)
+
+		if self.pending:
+			return True
+		self.timer = None
+		return False
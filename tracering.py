@@ -0,0 +1,100 @@
+import json
+import logging
+from array import array
+from time import monotonic
+
+# Event kinds
+SIGNAL = 0
+CACHE = 1
+RENDER = 2
+LCD_WRITE = 3
+KEY = 4
+OWNER = 5
+CALL_BEGIN = 6
+CALL_END = 7
+
+KIND_NAMES = ("signal", "cache", "render", "lcd", "key", "owner", "call", "call")
+
+class TraceRing(object):
+	""" The last `size` events the process saw, in preallocated arrays
+	    that never grow, so that adding an event is a lookup and a few
+	    stores. Names are interned into a table and stored as a number;
+	    only a name that was not seen before adds to the table, the time
+	    and the arguments of the call are still short lived objects. A
+	    value goes with every event, a duration for renders or a byte
+	    count for LCD writes. Events that are overwritten are simply
+	    lost. """
+	MAX_NAMES = 65535
+
+	def __init__(self, size=4096):
+		self.size = size
+		self.times = array('d', [0.0]) * size
+		self.kinds = array('B', [0]) * size
+		self.names = array('H', [0]) * size
+		self.values = array('d', [0.0]) * size
+		self.strings = [""]
+		self.ids = {"": 0}
+		self.count = 0
+
+	def intern(self, name):
+		if len(self.strings) >= self.MAX_NAMES:
+			return 0
+		self.ids[name] = n = len(self.strings)
+		self.strings.append(name)
+		return n
+
+	def add(self, kind, name="", value=0.0):
+		i = self.count % self.size
+		self.count += 1
+		n = self.ids.get(name)
+		if n is None:
+			n = self.intern(name)
+		self.times[i] = monotonic()
+		self.kinds[i] = kind
+		self.names[i] = n
+		self.values[i] = value
+
+	def events(self):
+		# (time, kind, name, value), oldest first
+		for n in range(max(0, self.count - self.size), self.count):
+			i = n % self.size
+			name = self.strings[self.names[i]]
+			if isinstance(name, tuple):
+				name = " ".join(str(part) for part in name)
+			yield self.times[i], self.kinds[i], str(name), self.values[i]
+
+	def chrome(self):
+		""" The events in Chrome's trace event format, to be loaded in
+		    chrome://tracing or Perfetto. """
+		events = []
+		for when, kind, name, value in self.events():
+			event = {"name": name or KIND_NAMES[kind], "cat": KIND_NAMES[kind],
+				"ts": when * 1e6, "pid": 1, "tid": 1}
+			if kind == RENDER:
+				event.update(ph="X", ts=(when - value) * 1e6, dur=value * 1e6)
+			elif kind == CALL_BEGIN:
+				event["ph"] = "B"
+			elif kind == CALL_END:
+				event["ph"] = "E"
+			else:
+				event.update(ph="i", s="t", args={"value": value})
+			events.append(event)
+		return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+	def dump(self, filename):
+		""" Writes the events to filename, in Chrome's format if it ends in
+		    .json and as text otherwise. """
+		try:
+			with open(filename, "w") as f:
+				if filename.endswith(".json"):
+					json.dump(self.chrome(), f)
+				else:
+					for when, kind, name, value in self.events():
+						f.write("{:14.6f} {:<7} {} {:g}\n".format(when, KIND_NAMES[kind], name, value))
+		except OSError:
+			logging.exception("Failed to write trace to {}".format(filename))
+			return
+		logging.info("Wrote {} trace events to {}".format(min(self.count, self.size), filename))
+
+# Always on, for the whole process
+ring = TraceRing()
@@ -1,12 +1,32 @@
 from functools import partial
 from collections import defaultdict
 from cache import smart_dict
+from tracering import ring, SIGNAL, CACHE
+import dbuscall
 import dbus
 
 class Tracker(object):
+	QUERY_TIMEOUT_MS = 1000
+
+	# When set, every value that comes in is also handed to the recorder
+	recorder = None
+
+	# Keys holding restored values that were not confirmed by the service yet
+	stale_keys = frozenset()
+
 	def __init__(self):
 		self.cache = smart_dict()
 		self.watches = defaultdict(list)
+		self.listeners = []
+
+		# Paths that are only subscribed while this tracker is active, that
+		# is while anything that shows it (a display) has activated it
+		self.owners = set()
+		self.demand = defaultdict(list)
+		self.demand_watches = defaultdict(list)
+
+		# Input key -> derived values computed from it
+		self.derived = defaultdict(list)
 
 	def unwrap_dbus_value(self, val):
 		# Converts D-Bus values back to the original type. For example if val is of type DBus.Double, a float will be returned.
@@ -19,7 +39,8 @@ class Tracker(object):
 
 		return val
 
-	def update_cache(self, callback, key, v):
+	def unwrap_value(self, v):
+		# Takes a GetValue reply or signal payload and returns the plain value
 		if isinstance(v, dbus.Dictionary):
 			value = v["Value"]
 		elif isinstance(v, dbus.Array):
@@ -30,24 +51,101 @@ class Tracker(object):
 		if isinstance(value, dbus.Array):
 			value = None
 
-		self.cache[key] = v = self.unwrap_dbus_value(value)
+		return self.unwrap_dbus_value(value)
+
+	def update_cache(self, callback, key, v):
+		v = self.unwrap_value(v)
+		ring.add(CACHE, key)
+		old = self.cache.get(key)
+		self.cache[key] = v
+		if key in self.derived and old != v:
+			self.recompute(key)
 		if callback is not None:
 			callback(v)
+		for listener in self.listeners:
+			listener()
+
+	@property
+	def stale(self):
+		return bool(self.stale_keys)
+
+	def restore(self, values):
+		""" Fills the cache with restored values, which are stale until
+		    each of them is updated by its service. Derived values follow
+		    their inputs. """
+		self.cache.update(values)
+		self.recompute_all()
+		self.stale_keys = set(values) - set(target
+			for rules in self.derived.values() for target, inputs, function in rules)
+
+	def tracked(self):
+		# Cache keys that are kept up to date from a service
+		keys = set(target for watches in self.watches.values() for target, w in watches)
+		keys.update(target for paths in self.demand.values()
+			for conn, path, target, callback in paths)
+		return keys
+
+	def derive(self, target, inputs, function):
+		""" Keeps self.cache[target] at function(*inputs), with inputs being
+		    cache keys, so that pages can read computed values like any
+		    other. It is only recomputed when one of the inputs changes. """
+		rule = (target, inputs, function)
+		for key in inputs:
+			self.derived[key].append(rule)
+		self.cache[target] = function(*(self.cache.get(k) for k in inputs))
+
+	def recompute(self, key):
+		for target, inputs, function in self.derived[key]:
+			v = function(*(self.cache.get(k) for k in inputs))
+			if self.cache.get(target) != v:
+				self.cache[target] = v
+				if target in self.derived:
+					self.recompute(target)
+
+	def recompute_all(self):
+		# For a cache that was filled in one go, like a restored snapshot
+		for key in list(self.derived):
+			self.recompute(key)
+
+	def ingest(self, service, path, callback, key, v, seed=False):
+		if self.stale_keys:
+			self.stale_keys.discard(key)
+		if not seed:
+			ring.add(SIGNAL, (service, path))
+		if self.recorder is not None:
+			self.recorder.value(service, path, self.unwrap_value(v), seed)
+		self.update_cache(callback, key, v)
 
 	def query(self, conn, service, path):
 		try:
-			return conn.call_blocking(service, path, None, "GetValue", '', [])
+			return dbuscall.call_blocking(conn, service, path, None, "GetValue",
+				timeout_ms=self.QUERY_TIMEOUT_MS)
 		except:
 			return None
 
-	def track(self, conn, service, path, target, callback=None):
+	def track(self, conn, service, path, target, callback=None, demand=False):
+		""" Keeps self.cache[target] up to date with path on service. With
+		    demand set, the path is only subscribed to while the tracker is
+		    active, for values that are only needed when shown. """
+		if demand:
+			self.cache.setdefault(target, None)
+			self.demand[service].append((conn, path, target, callback))
+			if self.active:
+				self.subscribe(conn, service, path, target, callback, self.demand_watches)
+		else:
+			self.subscribe(conn, service, path, target, callback, self.watches)
+
+	def subscribe(self, conn, service, path, target, callback, watches):
 
-		# Initialise cache values
-		self.update_cache(callback, target, self.query(conn, service, path))
+		# Initialise cache values. If the service is not responding, keep
+		# what we have until a signal arrives.
+		if not dbuscall.circuit_open(service):
+			self.ingest(service, path, callback, target,
+				self.query(conn, service, path), seed=True)
 
 		# If there are values on dbus update cache after property change
-		self.watches[service].append((target, conn.add_signal_receiver(
-			partial(self.update_cache, callback, target),
+		watches[service].append((target, conn.add_signal_receiver(
+			partial(self.ingest, service, path, callback, target),
 			dbus_interface='com.victronenergy.BusItem',
 			signal_name='PropertiesChanged',
 			path=path,
@@ -57,11 +155,11 @@ class Tracker(object):
 		# ItemsChanged
 		def update_items(items):
 			try:
-				self.update_cache(callback, target, items[path])
+				self.ingest(service, path, callback, target, items[path])
 			except (TypeError, KeyError):
 				pass
 
-		self.watches[service].append((target, conn.add_signal_receiver(
+		watches[service].append((target, conn.add_signal_receiver(
 			update_items,
 			dbus_interface='com.victronenergy.BusItem',
 			signal_name='ItemsChanged',
@@ -69,9 +167,48 @@ class Tracker(object):
 			bus_name=service
 		)))
 
-	def cleanup(self, name):
-		if name in self.watches:
-			for target, w in self.watches[name]:
+	@property
+	def active(self):
+		return bool(self.owners)
+
+	def activate(self, owner=None):
+		# Subscribe to demand paths, seeding them with fresh values
+		if self.active:
+			self.owners.add(owner)
+			return
+		self.owners.add(owner)
+		for service, paths in list(self.demand.items()):
+			for conn, path, target, callback in paths:
+				self.subscribe(conn, service, path, target, callback, self.demand_watches)
+
+	def deactivate(self, owner=None):
+		if not self.active:
+			return
+		self.owners.discard(owner)
+		if self.owners:
+			return
+		# Values that are no longer followed are shown as not available,
+		# rather than as if they were still live
+		for watches in self.demand_watches.values():
+			for target, w in watches:
 				w.remove()
 				self.update_cache(None, target, None)
-			del self.watches[name]
+		self.demand_watches.clear()
+
+	@property
+	def subscriptions(self):
+		return sum(len(w) for w in self.watches.values()) + \
+			sum(len(w) for w in self.demand_watches.values())
+
+	def cleanup(self, name):
+		self.demand.pop(name, None)
+		for watches in (self.watches, self.demand_watches):
+			if name in watches:
+				for target, w in watches[name]:
+					w.remove()
+					self.update_cache(None, target, None)
+				del watches[name]
+
+	def cleanup_all(self):
+		for name in set(self.watches) | set(self.demand):
+			self.cleanup(name)